@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+
+from blobs import claim_garbage, purge_blobs
+from thumbnails import thumb_key
+
+logger = logging.getLogger(__name__)
+
+# Seconds between collection rounds when nobody wakes the collector
+BLOB_GC_INTERVAL = float(os.getenv('BLOB_GC_INTERVAL', '30'))
+# Blobs claimed per round; each one is an original plus its thumbnail
+BLOB_GC_BATCH_SIZE = int(os.getenv('BLOB_GC_BATCH_SIZE', '500'))
+# Failed deletions are retried after this delay, doubling up to the maximum
+BLOB_GC_RETRY_DELAY = int(os.getenv('BLOB_GC_RETRY_DELAY', '30'))
+BLOB_GC_RETRY_MAX_DELAY = int(os.getenv('BLOB_GC_RETRY_MAX_DELAY', '3600'))
+
+# Limit of a single S3 DeleteObjects request
+S3_DELETE_MAX_KEYS = 1000
+
+
+class BlobCollector:
+    """
+    Background task that deletes the S3 objects of tombstoned blobs.
+
+    Deleting images only tombstones their blobs, so requests return without
+    touching S3. The collector claims due tombstones in batches, removes the
+    objects with multi-object deletes and drops the tombstones of blobs that
+    are gone. Blobs that fail stay tombstoned and are retried with backoff.
+    Several server processes may run a collector against the same database.
+    """
+
+    def __init__(self, db_pool, s3_client, bucket,
+                 interval=BLOB_GC_INTERVAL, batch_size=BLOB_GC_BATCH_SIZE):
+        self.db_pool = db_pool
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self._task = None
+        self._loop = None
+        self._wake = None
+        self._deleted = 0
+        self._failed = 0
+        self._rounds = 0
+
+    def start(self):
+        """
+        Spawn the collector on the running event loop.
+        """
+        if self._task:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Started blob collector (every %ss, %d blobs per batch)",
+                    self.interval, self.batch_size)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        """
+        Ask for a collection round now. Safe to call from any thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stats(self):
+        return {
+            "deleted": self._deleted,
+            "failed": self._failed,
+            "rounds": self._rounds,
+        }
+
+    async def collect(self):
+        """
+        Run one collection round.
+        Returns:
+            int: Number of blobs claimed.
+        """
+        blob_keys = await self.db_pool.run(
+            claim_garbage, self.batch_size, BLOB_GC_RETRY_DELAY,
+            BLOB_GC_RETRY_MAX_DELAY)
+        if not blob_keys:
+            return 0
+        deleted = await asyncio.to_thread(self._delete_objects, blob_keys)
+        if deleted:
+            await self.db_pool.run(purge_blobs, deleted)
+        self._rounds += 1
+        self._deleted += len(deleted)
+        self._failed += len(blob_keys) - len(deleted)
+        return len(blob_keys)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # Keep going while full batches come back
+                while await self.collect() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Blob collection round failed")
+
+    def _delete_objects(self, blob_keys):
+        """
+        Delete the objects of ``blob_keys`` from S3. Blocking.
+        Returns:
+            list: Blob keys whose objects are all gone.
+        """
+        owners = {}
+        for blob_key in blob_keys:
+            owners[blob_key] = blob_key
+            owners[thumb_key(blob_key)] = blob_key
+        object_keys = list(owners)
+
+        failed = set()
+        for start in range(0, len(object_keys), S3_DELETE_MAX_KEYS):
+            batch = object_keys[start:start + S3_DELETE_MAX_KEYS]
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={
+                        "Objects": [{"Key": key} for key in batch],
+                        "Quiet": True,
+                    }
+                )
+            except Exception as e:
+                logger.error(f"S3 batch delete of {len(batch)} objects failed: {str(e)}")
+                failed.update(owners[key] for key in batch)
+                continue
+            # Quiet mode only reports the keys that could not be deleted
+            for error in response.get("Errors", []):
+                logger.warning(f"Failed to delete {error.get('Key')} from S3: {error.get('Code')} {error.get('Message')}")
+                failed.add(owners.get(error.get("Key"), error.get("Key")))
+        return [blob_key for blob_key in blob_keys if blob_key not in failed]
@@ -0,0 +1,207 @@
+"""
+Image bytes live in S3 as blobs that several image rows may share. Every
+row in ``images`` points at a blob through ``blob_key`` and every blob has a
+row in ``image_blobs`` counting those references. Copying an image is a new
+``images`` row plus a refcount increment. When the last reference goes
+away the blob is tombstoned (``deleted_at``) and its S3 objects are removed
+later, in batches, by the background collector in ``blob_gc``.
+"""
+import uuid
+from collections import Counter
+from datetime import datetime
+
+import mysql.connector
+from mysql.connector import errorcode
+
+
+def new_blob_key():
+    """
+    Key for freshly uploaded bytes. Blobs are never overwritten in place, so
+    a key always refers to the same content.
+    """
+    return f"images/{uuid.uuid4()}"
+
+
+def ensure_schema(conn):
+    """
+    Create the blob table and adopt images stored before blobs existed,
+    whose bytes live at ``images/<image id>``. Safe to run on every start
+    and from several workers at once.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS image_blobs (
+        blob_key VARCHAR(255) NOT NULL PRIMARY KEY,
+        refcount INT NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL
+    )
+    """)
+    _add_column(cursor, "images", "blob_key", """
+    ALTER TABLE images
+        ADD COLUMN blob_key VARCHAR(255) NULL,
+        ADD INDEX images_blob_key (blob_key)
+    """)
+    _add_column(cursor, "image_blobs", "deleted_at", """
+    ALTER TABLE image_blobs
+        ADD COLUMN deleted_at DATETIME NULL,
+        ADD COLUMN gc_after DATETIME NULL,
+        ADD COLUMN gc_attempts INT NOT NULL DEFAULT 0,
+        ADD INDEX image_blobs_gc_after (gc_after)
+    """)
+
+    cursor.execute("""
+    INSERT IGNORE INTO image_blobs (blob_key, refcount, created_at)
+    SELECT CONCAT('images/', id), 1, %s FROM images WHERE blob_key IS NULL
+    """, (datetime.now(),))
+    cursor.execute("""
+    UPDATE images SET blob_key = CONCAT('images/', id) WHERE blob_key IS NULL
+    """)
+    conn.commit()
+    cursor.close()
+
+
+def _add_column(cursor, table, column, ddl):
+    cursor.execute("""
+    SELECT COUNT(*) FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    if cursor.fetchone()[0]:
+        return
+    try:
+        cursor.execute(ddl)
+    except mysql.connector.Error as err:
+        # Another worker added it first
+        if err.errno not in (errorcode.ER_DUP_FIELDNAME,
+                             errorcode.ER_DUP_KEYNAME):
+            raise
+
+
+def add_blob(conn, blob_key):
+    """
+    Register newly uploaded bytes with a single reference.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    INSERT INTO image_blobs (blob_key, refcount, created_at)
+    VALUES (%s, 1, %s)
+    ON DUPLICATE KEY UPDATE refcount = refcount + 1
+    """, (blob_key, datetime.now()))
+    cursor.close()
+
+
+def copy_project_images(conn, source_project_id, target_project_id):
+    """
+    Copy every image row of one project into another. The copies share the
+    source blobs, so no bytes are transferred.
+    Returns:
+        int: Number of images copied.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    INSERT INTO images (id, project_id, type, seed, prompt, parameters, blob_key)
+    SELECT UUID(), %s, type, seed, prompt, parameters, blob_key
+    FROM images
+    WHERE project_id = %s
+    """, (target_project_id, source_project_id))
+    copied = cursor.rowcount
+    if copied:
+        cursor.execute("""
+        UPDATE image_blobs b
+        JOIN (
+            SELECT blob_key, COUNT(*) AS refs
+            FROM images
+            WHERE project_id = %s
+            GROUP BY blob_key
+        ) i ON b.blob_key = i.blob_key
+        SET b.refcount = b.refcount + i.refs
+        """, (target_project_id,))
+    cursor.close()
+    return copied
+
+
+def release_refs(conn, where, params):
+    """
+    Drop the references held by the images matching ``where``, an SQL
+    condition on ``images``. Call before deleting those rows, in the same
+    transaction. Blobs left without references are tombstoned for the
+    collector.
+    Returns:
+        list: Keys of blobs that are no longer referenced.
+    """
+    cursor = conn.cursor()
+    # A locking read, so the rows counted are exactly the ones the caller's
+    # DELETE will see, including images committed since the snapshot
+    cursor.execute(f"""
+    SELECT blob_key FROM images
+    WHERE {where} AND blob_key IS NOT NULL
+    FOR UPDATE
+    """, params)
+    released = sorted(Counter(row[0] for row in cursor.fetchall()).items())
+
+    now = datetime.now()
+    garbage = []
+    for blob_key, refs in released:
+        cursor.execute("""
+        SELECT refcount FROM image_blobs WHERE blob_key = %s FOR UPDATE
+        """, (blob_key,))
+        row = cursor.fetchone()
+        remaining = (row[0] if row else 0) - refs
+        if remaining > 0:
+            cursor.execute("""
+            UPDATE image_blobs SET refcount = %s WHERE blob_key = %s
+            """, (remaining, blob_key))
+        else:
+            cursor.execute("""
+            UPDATE image_blobs
+            SET refcount = 0, deleted_at = %s, gc_after = %s
+            WHERE blob_key = %s
+            """, (now, now, blob_key))
+            garbage.append(blob_key)
+    cursor.close()
+    return garbage
+
+
+def claim_garbage(conn, limit, retry_delay, max_retry_delay):
+    """
+    Pick up to ``limit`` tombstoned blobs that are due for collection.
+    Claimed blobs are not handed out again until a backoff delay has
+    passed, which doubles with every attempt; if deleting them fails they
+    are simply picked up again after that delay.
+    Returns:
+        list: Blob keys to delete from S3.
+    """
+    now = datetime.now()
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT blob_key FROM image_blobs
+    WHERE deleted_at IS NOT NULL AND gc_after <= %s
+    ORDER BY gc_after
+    LIMIT %s
+    FOR UPDATE
+    """, (now, limit))
+    blob_keys = [row[0] for row in cursor.fetchall()]
+    if blob_keys:
+        placeholders = ", ".join(["%s"] * len(blob_keys))
+        cursor.execute(f"""
+        UPDATE image_blobs
+        SET gc_after = DATE_ADD(%s, INTERVAL LEAST(%s, %s * POW(2, gc_attempts)) SECOND),
+            gc_attempts = gc_attempts + 1
+        WHERE blob_key IN ({placeholders})
+        """, (now, max_retry_delay, retry_delay, *blob_keys))
+    conn.commit()
+    cursor.close()
+    return blob_keys
+
+
+def purge_blobs(conn, blob_keys):
+    """
+    Remove the tombstones of blobs whose S3 objects are gone.
+    """
+    placeholders = ", ".join(["%s"] * len(blob_keys))
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    DELETE FROM image_blobs
+    WHERE blob_key IN ({placeholders}) AND deleted_at IS NOT NULL
+    """, tuple(blob_keys))
+    conn.commit()
+    cursor.close()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errorcode, pooling
+
+logger = logging.getLogger(__name__)
+
+# mysql-connector caps a single pool at 32 connections
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '10'))
+# Seconds a request may wait for a free connection before failing
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', '10'))
+
+
+class PoolTimeoutError(mysql.connector.errors.PoolError):
+    "Raised when no pooled connection became free within the timeout"
+
+
+class ConnectionPool:
+    """
+    MySQL connection pool with per-request checkout.
+
+    Callers block (up to ``timeout`` seconds) while every connection is in
+    use instead of failing immediately, and wait times are recorded for
+    ``stats()``. mysql-connector pings each pooled connection on checkout
+    and reconnects it if the server dropped it, so one lost connection no
+    longer takes the whole API down.
+    """
+
+    def __init__(self, pool_size=DATABASE_POOL_SIZE,
+                 timeout=DATABASE_POOL_TIMEOUT, **connect_args):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name="backend",
+            pool_size=pool_size,
+            pool_reset_session=True,
+            **connect_args,
+        )
+        self._slots = threading.BoundedSemaphore(pool_size)
+        # One thread per connection: async callers queue here, not on the loop
+        self._executor = ThreadPoolExecutor(max_workers=pool_size,
+                                            thread_name_prefix="db")
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._in_use = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of the ``with`` block.
+
+        Uncommitted work is rolled back when the block exits, and the
+        connection is returned to the pool.
+        """
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self._timeouts += 1
+            raise PoolTimeoutError(
+                f"No database connection available after {self.timeout}s")
+        try:
+            conn = self._pool.get_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        try:
+            yield conn
+        finally:
+            try:
+                conn.rollback()
+            except mysql.connector.Error as err:
+                logger.warning(f"Rollback on checkin failed: {str(err)}")
+            finally:
+                conn.close()
+                with self._stats_lock:
+                    self._in_use -= 1
+                self._slots.release()
+
+    async def run(self, fn, *args):
+        """
+        Run ``fn(conn, *args)`` with a pooled connection on the database
+        executor and await its result, so queries never block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    def _call(self, fn, args):
+        with self.connection() as conn:
+            return fn(conn, *args)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "poolSize": self.pool_size,
+                "inUse": self._in_use,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "waitAvgMs": round(self._wait_total / self._checkouts * 1000, 2)
+                if self._checkouts else 0.0,
+                "waitMaxMs": round(self._wait_max * 1000, 2),
+            }
+
+
+def ensure_index(conn, table, name, columns):
+    """
+    Create an index unless it already exists. Safe to run concurrently from
+    several workers.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT COUNT(*) FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, name))
+    if cursor.fetchone()[0] == 0:
+        try:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+        except mysql.connector.Error as err:
+            if err.errno != errorcode.ER_DUP_KEYNAME:
+                raise
+    cursor.close()
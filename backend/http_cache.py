@@ -0,0 +1,65 @@
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi.responses import Response
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against a quoted ETag (weak comparison,
+    as RFC 9110 requires for If-None-Match).
+    """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def http_date(value):
+    """
+    Format a datetime for Last-Modified. Naive values are local time, which
+    is how the backend stores timestamps.
+    """
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def is_not_modified(if_none_match, if_modified_since, etag, last_modified=None):
+    """
+    Decide whether a conditional GET can be answered with 304.
+    If-Modified-Since is only considered when If-None-Match is absent.
+    """
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+        return modified <= since
+    return False
+
+
+def not_modified_response(etag=None, last_modified=None, cache_control=None):
+    headers = {}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return Response(status_code=304, headers=headers)
+
+
+def row_etag(*parts):
+    """
+    Strong ETag for a database row, derived from its id and modified_at.
+    """
+    digest = hashlib.sha1(
+        ":".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
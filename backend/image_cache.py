@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Total bytes kept in memory, and the largest single image worth caching
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ITEM_BYTES = int(os.getenv('IMAGE_CACHE_MAX_ITEM_BYTES', str(16 * 1024 * 1024)))
+# Optional second tier on local disk; disabled when IMAGE_CACHE_DIR is empty
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', '')
+IMAGE_CACHE_DISK_MAX_BYTES = int(os.getenv('IMAGE_CACHE_DISK_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+# ETags are tiny, so many more are remembered than bytes are kept
+IMAGE_CACHE_MAX_ETAGS = int(os.getenv('IMAGE_CACHE_MAX_ETAGS', '100000'))
+# Downloads streamed from S3 are only copied into the cache when the object
+# is at most IMAGE_STREAM_CACHE_MAX_BYTES, and while all such copies in
+# progress together stay within IMAGE_STREAM_BUFFER_BYTES
+IMAGE_STREAM_CACHE_MAX_BYTES = int(os.getenv('IMAGE_STREAM_CACHE_MAX_BYTES', str(1024 * 1024)))
+IMAGE_STREAM_BUFFER_BYTES = int(os.getenv('IMAGE_STREAM_BUFFER_BYTES', str(32 * 1024 * 1024)))
+
+
+def content_etag(data):
+    """
+    Strong ETag for a blob. Matches the S3 ETag of objects uploaded with a
+    single put_object call.
+    """
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+class ByteBudget:
+    """
+    Thread-safe count of bytes held for a purpose, capped at ``limit``.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, size):
+        """
+        Returns:
+            bool: True if ``size`` bytes were reserved; release() them later.
+        """
+        with self._lock:
+            if self._used + size > self.limit:
+                return False
+            self._used += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self._used -= size
+
+
+class ImageCache:
+    """
+    Size-bounded LRU cache of image bytes keyed by S3 key, with an
+    optional on-disk tier. Entries evicted from memory stay on disk until
+    the disk tier is full. The ETag of every cached image is remembered
+    separately so conditional requests can be answered without the bytes.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES,
+                 max_item_bytes=IMAGE_CACHE_MAX_ITEM_BYTES,
+                 disk_dir=IMAGE_CACHE_DIR,
+                 disk_max_bytes=IMAGE_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._etags = OrderedDict()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def get(self, key):
+        """
+        Returns:
+            bytes: The cached image, or None on a miss.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                return data
+            on_disk = key in self._disk
+        if on_disk:
+            data = self._read_disk(key)
+            if data is not None:
+                etag = None if key in self._etags else content_etag(data)
+                with self._lock:
+                    self._disk_hits += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._put_memory(key, data)
+                    if etag:
+                        self._put_etag(key, etag)
+                return data
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key, data, etag=None):
+        if len(data) > self.max_item_bytes:
+            if etag:
+                self.set_etag(key, etag)
+            return
+        etag = etag or content_etag(data)
+        with self._lock:
+            self._put_memory(key, data)
+            self._put_etag(key, etag)
+        if self.disk_dir:
+            self._write_disk(key, data)
+
+    def etag(self, key):
+        """
+        Returns:
+            str: The quoted ETag last seen for ``key``, or None.
+        """
+        with self._lock:
+            etag = self._etags.get(key)
+            if etag is not None:
+                self._etags.move_to_end(key)
+            return etag
+
+    def set_etag(self, key, etag):
+        with self._lock:
+            self._put_etag(key, etag)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._etags.pop(key, None)
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+            size = self._disk.pop(key, None)
+            if size is not None:
+                self._disk_bytes -= size
+        if self.disk_dir:
+            for suffix in ("", ".key"):
+                try:
+                    os.remove(self._disk_path(key) + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "diskHits": self._disk_hits,
+                "misses": self._misses,
+                "entries": len(self._memory),
+                "bytes": self._memory_bytes,
+                "diskEntries": len(self._disk),
+                "diskBytes": self._disk_bytes,
+            }
+
+    def _put_memory(self, key, data):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _put_etag(self, key, etag):
+        self._etags[key] = etag
+        self._etags.move_to_end(key)
+        while len(self._etags) > IMAGE_CACHE_MAX_ETAGS:
+            self._etags.popitem(last=False)
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, name)
+
+    def _load_disk_index(self):
+        # File names are hashes, so keep a sidecar with the original key
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".key"):
+                continue
+            data_path = os.path.join(self.disk_dir, name[:-4])
+            try:
+                with open(os.path.join(self.disk_dir, name), encoding="utf-8") as f:
+                    key = f.read()
+                stat = os.stat(data_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None
+
+    def _write_disk(self, key, data):
+        path = self._disk_path(key)
+        try:
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with open(f"{path}.key", "w", encoding="utf-8") as f:
+                f.write(key)
+        except OSError as e:
+            logger.warning(f"Failed to write image cache file {path}: {str(e)}")
+            return
+        evicted = []
+        with self._lock:
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._disk_bytes -= old
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+                evicted_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            for suffix in ("", ".key"):
+                try:
+                    os.remove(self._disk_path(evicted_key) + suffix)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+BEDROCK_REGION = os.getenv('BEDROCK_REGION', 'us-east-1')
+# Size the pool for the number of Bedrock calls expected in flight per process
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '32'))
+BEDROCK_CONNECT_TIMEOUT = float(os.getenv('BEDROCK_CONNECT_TIMEOUT', '10'))
+BEDROCK_READ_TIMEOUT = float(os.getenv('BEDROCK_READ_TIMEOUT', '300'))
+
+_clients = {}
+_clients_lock = threading.Lock()
+_executor = None
+
+
+def bedrock_config():
+    """
+    Returns:
+        Config: botocore config shared by every Bedrock runtime client.
+    """
+    # Every call goes through an AdaptiveLimiter, which owns all retries
+    # (see bedrock_limiter.py). botocore retrying throttled calls on its own
+    # would multiply the attempts and hide throttling from the limiter.
+    return Config(
+        connect_timeout=BEDROCK_CONNECT_TIMEOUT,
+        read_timeout=BEDROCK_READ_TIMEOUT,
+        max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={
+            "mode": "standard",
+            "max_attempts": 1,
+        },
+    )
+
+
+def get_bedrock_runtime(region_name=BEDROCK_REGION):
+    """
+    Get the process-wide Bedrock runtime client for a region.
+
+    The client is created on first use and then reused, so credential
+    resolution, endpoint setup and TLS connections are shared by every call.
+    botocore clients are thread-safe.
+    """
+    client = _clients.get(region_name)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(region_name)
+        if client is None:
+            logger.info(
+                "Creating Bedrock runtime client for %s (pool size %d)",
+                region_name, BEDROCK_MAX_POOL_CONNECTIONS)
+            client = boto3.session.Session().client(
+                service_name='bedrock-runtime',
+                region_name=region_name,
+                config=bedrock_config(),
+            )
+            _clients[region_name] = client
+    return client
+
+
+def get_bedrock_executor():
+    """
+    Get the executor that runs blocking Bedrock calls for async callers.
+
+    It has one thread per pooled connection, so the number of threads is
+    bounded by the pool size rather than by the number of jobs in flight.
+    """
+    global _executor
+    if _executor is None:
+        with _clients_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=BEDROCK_MAX_POOL_CONNECTIONS,
+                    thread_name_prefix="bedrock")
+    return _executor
@@ -0,0 +1,246 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError
+
+logger = logging.getLogger(__name__)
+
+# Request rate (token bucket) and concurrency ceiling per model family.
+# Set the rates near the account's Bedrock quota; concurrency adapts below
+# the ceiling on its own.
+BEDROCK_IMAGE_RPS = float(os.getenv('BEDROCK_IMAGE_RPS', '1'))
+BEDROCK_IMAGE_BURST = float(os.getenv('BEDROCK_IMAGE_BURST', '2'))
+BEDROCK_IMAGE_CONCURRENCY = int(os.getenv('BEDROCK_IMAGE_CONCURRENCY', '4'))
+BEDROCK_TEXT_RPS = float(os.getenv('BEDROCK_TEXT_RPS', '5'))
+BEDROCK_TEXT_BURST = float(os.getenv('BEDROCK_TEXT_BURST', '10'))
+BEDROCK_TEXT_CONCURRENCY = int(os.getenv('BEDROCK_TEXT_CONCURRENCY', '16'))
+# Retries of throttled or transiently failed calls, with full-jitter
+# exponential backoff. The Bedrock clients do not retry on their own.
+BEDROCK_THROTTLE_RETRIES = int(os.getenv('BEDROCK_THROTTLE_RETRIES', '4'))
+BEDROCK_BACKOFF_BASE = float(os.getenv('BEDROCK_BACKOFF_BASE', '1'))
+BEDROCK_BACKOFF_MAX = float(os.getenv('BEDROCK_BACKOFF_MAX', '30'))
+# Longest a call waits for admission before giving up
+BEDROCK_ACQUIRE_TIMEOUT = float(os.getenv('BEDROCK_ACQUIRE_TIMEOUT', '300'))
+
+THROTTLING_CODES = ("ThrottlingException", "TooManyRequestsException",
+                    "ServiceQuotaExceededException")
+# Failures worth retrying that say nothing about the request rate
+TRANSIENT_CODES = ("ServiceUnavailableException", "InternalServerException",
+                   "ModelNotReadyException")
+
+
+class AdmissionTimeoutError(Exception):
+    "Raised when a Bedrock call could not be admitted in time"
+
+    def __init__(self, message):
+        self.message = message
+
+
+def is_throttling(error):
+    return (isinstance(error, ClientError)
+            and error.response.get("Error", {}).get("Code") in THROTTLING_CODES)
+
+
+def is_transient(error):
+    if isinstance(error, ConnectionError):
+        return True
+    return (isinstance(error, ClientError)
+            and error.response.get("Error", {}).get("Code") in TRANSIENT_CODES)
+
+
+class AdaptiveLimiter:
+    """
+    Process-wide admission control for one Bedrock model family.
+
+    A call needs a token from a bucket refilled at ``rate`` per second and a
+    free concurrency slot. The number of slots follows AIMD: it grows by
+    about one per round of successful calls up to ``max_concurrency`` and
+    is halved when Bedrock throttles, so throughput settles just under the
+    quota instead of collapsing into retries. Safe to use from any thread.
+    """
+
+    def __init__(self, name, rate, burst, max_concurrency,
+                 min_concurrency=1):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self._limit = float(self.max_concurrency)
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._admitted = 0
+        self._throttled = 0
+        self._wait_total = 0.0
+
+    def acquire(self, timeout=BEDROCK_ACQUIRE_TIMEOUT):
+        """
+        Block until the call may proceed.
+        Raises:
+            AdmissionTimeoutError: If that takes longer than ``timeout``.
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._in_flight < int(self._limit) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    self._admitted += 1
+                    self._wait_total += now - started
+                    return
+                if now >= deadline:
+                    raise AdmissionTimeoutError(
+                        f"{self.name}: no Bedrock capacity after {timeout}s")
+                # Sleep until a token is due or a slot is released
+                wait = deadline - now
+                if self._tokens < 1 and self.rate > 0:
+                    wait = min(wait, (1 - self._tokens) / self.rate)
+                self._cond.wait(wait)
+
+    def release(self, throttled=False, succeeded=True):
+        """
+        Give back the slot of an admitted call. Only successful calls grow
+        the concurrency limit and only throttled ones shrink it; other
+        failures leave it alone.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self._throttled += 1
+                # Calls in flight when throttling starts all fail together;
+                # count that as one signal
+                if now - self._last_decrease > 1.0:
+                    self._limit = max(self.min_concurrency, self._limit / 2)
+                    self._last_decrease = now
+                    logger.warning("%s throttled, concurrency limit now %d",
+                                   self.name, int(self._limit))
+            elif succeeded:
+                self._limit = min(self.max_concurrency,
+                                  self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Run ``fn`` once admitted, retrying throttled and transiently failed
+        attempts with jittered exponential backoff.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling(e)
+                self.release(throttled=throttled, succeeded=False)
+                if attempt >= BEDROCK_THROTTLE_RETRIES or not (
+                        throttled or is_transient(e)):
+                    raise
+                attempt += 1
+                self._backoff(attempt, e)
+                continue
+            self.release()
+            return result
+
+    def stream(self, fn, *args, **kwargs):
+        """
+        Like call(), for a Bedrock streaming response: yields the events of
+        ``fn(...)["stream"]`` and keeps the slot until the stream is read and
+        closed. A throttle raised mid-stream is reported like any other, but
+        only failures before the first event are retried.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            started = False
+            try:
+                stream = fn(*args, **kwargs)["stream"]
+                try:
+                    for event in stream:
+                        started = True
+                        yield event
+                finally:
+                    stream.close()
+            except Exception as e:
+                throttled = is_throttling(e)
+                self.release(throttled=throttled, succeeded=False)
+                if started or attempt >= BEDROCK_THROTTLE_RETRIES or not (
+                        throttled or is_transient(e)):
+                    raise
+                attempt += 1
+                self._backoff(attempt, e)
+                continue
+            except BaseException:
+                # The consumer closed the generator early
+                self.release(succeeded=False)
+                raise
+            self.release()
+            return
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": int(self._limit),
+                "inFlight": self._in_flight,
+                "admitted": self._admitted,
+                "throttled": self._throttled,
+                "waitAvgMs": round(self._wait_total / self._admitted * 1000, 2)
+                if self._admitted else 0.0,
+            }
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(
+            0, min(BEDROCK_BACKOFF_MAX, BEDROCK_BACKOFF_BASE * 2 ** (attempt - 1)))
+        logger.info("%s call failed (%s), retry %d in %.2fs",
+                    self.name, type(error).__name__, attempt, delay)
+        time.sleep(delay)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name, rate, burst, max_concurrency):
+    """
+    Get the shared limiter called ``name``, creating it on first use.
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = AdaptiveLimiter(name, rate, burst, max_concurrency)
+                _limiters[name] = limiter
+    return limiter
+
+
+def image_limiter():
+    "Limiter shared by all Nova Canvas calls"
+    return get_limiter("nova-canvas", BEDROCK_IMAGE_RPS, BEDROCK_IMAGE_BURST,
+                       BEDROCK_IMAGE_CONCURRENCY)
+
+
+def text_limiter():
+    "Limiter shared by all Nova Pro (prompt enhancement) calls"
+    return get_limiter("nova-pro", BEDROCK_TEXT_RPS, BEDROCK_TEXT_BURST,
+                       BEDROCK_TEXT_CONCURRENCY)
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
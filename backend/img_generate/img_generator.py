@@ -1,22 +1,39 @@
 import logging
-import boto3
 import base64
 import io
-import json
-from botocore.config import Config
-from botocore.exceptions import ClientError
 from PIL import Image
 import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
+from img_generate.nova_canvas import (ImageError, get_client,
+                                      image_variation_request,
+                                      text_image_request)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-class ImageError(Exception):
-    "Custom exception for errors returned by Amazon Nova Canvas"
+# Generated images are saved exactly as the model returns them unless a
+# format (JPEG, WEBP or PNG) is set here to re-encode them
+GENERATED_IMAGE_FORMAT = os.getenv('GENERATED_IMAGE_FORMAT', '').upper()
+GENERATED_IMAGE_QUALITY = int(os.getenv('GENERATED_IMAGE_QUALITY', '90'))
+GENERATED_IMAGE_PROGRESSIVE = os.getenv('GENERATED_IMAGE_PROGRESSIVE', '0') == '1'
+GENERATED_IMAGE_WORKERS = int(os.getenv('GENERATED_IMAGE_WORKERS', str(os.cpu_count() or 1)))
 
-    def __init__(self, message):
-        self.message = message
+if GENERATED_IMAGE_FORMAT not in ("", "JPEG", "WEBP", "PNG"):
+    raise ValueError(f"Unsupported GENERATED_IMAGE_FORMAT: {GENERATED_IMAGE_FORMAT}")
+
+_reencode_pool = None
+_reencode_pool_lock = threading.Lock()
+
+IMAGE_MEDIA_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+    "gif": "image/gif",
+}
 
 
 def generate_images(model_id, task_id, prompt, batch_count=1, height=1024, width=1024, cfg_scale=8.0, seed=0):
@@ -26,43 +43,37 @@ def generate_images(model_id, task_id, prompt, batch_count=1, height=1024, width
     logger.info(
         "Generating %d images with Amazon Nova Canvas model %s", batch_count, model_id)
 
-    bedrock = boto3.client(
-        service_name='bedrock-runtime',
-        config=Config(read_timeout=300),
-        region_name='us-east-1' 
-    )
-
-    body = json.dumps({
-        "taskType": "TEXT_IMAGE",
-        "textToImageParams": {
-            "text": prompt
-        },
-        "imageGenerationConfig": {
-            "numberOfImages": batch_count,
-            "height": height,
-            "width": width,
-            "cfgScale": cfg_scale,
-            "seed": seed
-        }
-    })
-
-    accept = "application/json"
-    content_type = "application/json"
-
-    response = bedrock.invoke_model(
-        body=body, modelId=model_id, accept=accept, contentType=content_type
-    )
-    response_body = json.loads(response.get("body").read())
-
-    finish_reason = response_body.get("error")
-    if finish_reason is not None:
-        raise ImageError(f"Image generation error. Error is {finish_reason}")
-
-    image_list = []
-    for base64_image in response_body.get("images", []):
-        base64_bytes = base64_image.encode('ascii')
-        image_bytes = base64.b64decode(base64_bytes)
-        image_list.append(image_bytes)
+    body = text_image_request(prompt,
+                              batch_count=batch_count,
+                              height=height,
+                              width=width,
+                              cfg_scale=cfg_scale,
+                              seed=seed)
+    image_list = get_client(model_id).invoke_batch(body)
+
+    logger.info(
+        "Successfully generated %d images with Amazon Nova Canvas model %s",
+        len(image_list), model_id)
+
+    return image_list
+
+
+async def generate_images_async(model_id, task_id, prompt, batch_count=1, height=1024, width=1024, cfg_scale=8.0, seed=0, on_partial=None):
+    """
+    Async version of generate_images that does not block the event loop.
+    Large batches run as concurrent sub-requests; ``on_partial(start, images)``
+    is awaited as each one finishes.
+    """
+    logger.info(
+        "Generating %d images with Amazon Nova Canvas model %s", batch_count, model_id)
+
+    body = text_image_request(prompt,
+                              batch_count=batch_count,
+                              height=height,
+                              width=width,
+                              cfg_scale=cfg_scale,
+                              seed=seed)
+    image_list = await get_client(model_id).ainvoke_batch(body, on_partial)
 
     logger.info(
         "Successfully generated %d images with Amazon Nova Canvas model %s",
@@ -78,48 +89,43 @@ def process_images(model_id, task_id, prompt, base64_images, negative_prompt=Non
     logger.info(
         "Processing %d input images with Amazon Nova Canvas model %s", len(base64_images), model_id)
 
-    bedrock = boto3.client(
-        service_name='bedrock-runtime',
-        config=Config(read_timeout=300)
-        ,region_name='us-east-1'
-    )
-
-    params = {
-        "text": prompt,
-        "images": base64_images,
-        "similarityStrength": similarityStrength,  # Range: 0.2 to 1.0
-    }
-    if negative_prompt is not None:
-        params["negativeText"] = negative_prompt
-
-    body = json.dumps({
-        "taskType": "IMAGE_VARIATION",
-        "imageVariationParams": params,
-        "imageGenerationConfig": {
-            "numberOfImages": batch_count,
-            "height": height,
-            "width": width,
-            "cfgScale": cfg_scale,
-        }
-    })
-
-    accept = "application/json"
-    content_type = "application/json"
-
-    response = bedrock.invoke_model(
-        body=body, modelId=model_id, accept=accept, contentType=content_type
-    )
-    response_body = json.loads(response.get("body").read())
-
-    finish_reason = response_body.get("error")
-    if finish_reason is not None:
-        raise ImageError(f"Image processing error. Error is {finish_reason}")
-
-    image_list = []
-    for base64_image in response_body.get("images", []):
-        base64_bytes = base64_image.encode('ascii')
-        image_bytes = base64.b64decode(base64_bytes)
-        image_list.append(image_bytes)
+    body = image_variation_request(prompt,
+                                   base64_images,
+                                   negative_prompt=negative_prompt,
+                                   batch_count=batch_count,
+                                   height=height,
+                                   width=width,
+                                   cfg_scale=cfg_scale,
+                                   similarity_strength=similarityStrength,
+                                   seed=seed)
+    image_list = get_client(model_id).invoke_batch(body)
+
+    logger.info(
+        "Successfully processed %d images with Amazon Nova Canvas model %s",
+        len(image_list), model_id)
+
+    return image_list
+
+
+async def process_images_async(model_id, task_id, prompt, base64_images, negative_prompt=None,  batch_count=1, height=1024, width=1024,  cfg_scale=8.0, seed=0, similarityStrength=0.7, on_partial=None):
+    """
+    Async version of process_images that does not block the event loop.
+    Large batches run as concurrent sub-requests; ``on_partial(start, images)``
+    is awaited as each one finishes.
+    """
+    logger.info(
+        "Processing %d input images with Amazon Nova Canvas model %s", len(base64_images), model_id)
+
+    body = image_variation_request(prompt,
+                                   base64_images,
+                                   negative_prompt=negative_prompt,
+                                   batch_count=batch_count,
+                                   height=height,
+                                   width=width,
+                                   cfg_scale=cfg_scale,
+                                   similarity_strength=similarityStrength,
+                                   seed=seed)
+    image_list = await get_client(model_id).ainvoke_batch(body, on_partial)
 
     logger.info(
         "Successfully processed %d images with Amazon Nova Canvas model %s",
@@ -154,26 +160,101 @@ def get_image_size(image_data):
         raise ValueError("Invalid image format or corrupted image.")
 
 
-def save_images(task_id, image_bytes_list, output_dir="generated_images"):
+def sniff_extension(image_bytes):
+    """
+    File extension for encoded image bytes, read from the format's magic
+    number so the file can be written without decoding it.
+    """
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if image_bytes.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "webp"
+    if image_bytes[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    logger.warning("Unrecognized image format, saving as .bin")
+    return "bin"
+
+
+def media_type(image_bytes):
+    return IMAGE_MEDIA_TYPES.get(sniff_extension(image_bytes),
+                                 "application/octet-stream")
+
+
+def reencode_image(image_bytes, image_format, quality, progressive):
+    """
+    Re-encode an image. Runs in the re-encoding process pool.
+    Returns:
+        bytes: The encoded image.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    options = {"quality": quality}
+    if image_format == "JPEG":
+        options["optimize"] = True
+        options["progressive"] = progressive
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def _get_reencode_pool():
+    global _reencode_pool
+    with _reencode_pool_lock:
+        if _reencode_pool is None:
+            # Spawned, not forked: the server process has threads holding locks
+            _reencode_pool = ProcessPoolExecutor(
+                max_workers=GENERATED_IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"))
+    return _reencode_pool
+
+
+def encode_images(image_bytes_list):
+    """
+    Apply GENERATED_IMAGE_FORMAT re-encoding, if configured, in the process
+    pool. Otherwise the images are returned untouched. Blocking.
+    """
+    if not GENERATED_IMAGE_FORMAT:
+        return image_bytes_list
+    return list(_get_reencode_pool().map(
+        reencode_image,
+        image_bytes_list,
+        repeat(GENERATED_IMAGE_FORMAT),
+        repeat(GENERATED_IMAGE_QUALITY),
+        repeat(GENERATED_IMAGE_PROGRESSIVE)))
+
+
+def save_images(task_id, image_bytes_list, output_dir="generated_images", start_index=0):
     """
     Save generated images to a dictionary with task IDs mapping to file paths.
+
+    The model's bytes are written as they are, with the extension of their
+    format. If GENERATED_IMAGE_FORMAT is set they are re-encoded first, in a
+    process pool so the encoding does not hold the caller's thread or GIL.
     Args:
         image_bytes_list (list): List of image bytes to save.
         output_dir (str): Directory to save images to.
+        start_index (int): Position of the first image in its batch, used to
+            number the files when a batch is saved in parts.
     Returns:
         dict: A dictionary mapping 'task_id' to list of saved image paths.
     """
     os.makedirs(output_dir, exist_ok=True)
 
+    image_bytes_list = encode_images(image_bytes_list)
+
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    # save to s3
+    # The task id keeps tasks finishing in the same second apart
+    prefix = f"image_{timestamp}_{str(task_id)[:8]}"
     saved_paths = []
     for i, image_bytes in enumerate(image_bytes_list):
-        image = Image.open(io.BytesIO(image_bytes))
-        filepath = os.path.join(output_dir, f"image_{timestamp}_{i}.jpg")
-        image.save(filepath)
+        filepath = os.path.join(
+            output_dir, f"{prefix}_{start_index + i}.{sniff_extension(image_bytes)}")
+        with open(filepath, "wb") as f:
+            f.write(image_bytes)
         saved_paths.append("/"+filepath.replace("\\", "/"))
         logger.info(f"Saved image to {filepath}")
     logger.info(f"Saved images with task ID {task_id} to {output_dir}")
     return saved_paths
-    
\ No newline at end of file
@@ -1,20 +1,8 @@
 import base64
 import io
-import json
 import logging
-import boto3
-import os
 from PIL import Image
-from botocore.config import Config
-from datetime import datetime
-from botocore.exceptions import ClientError
-
-
-class ImageError(Exception):
-    "Custom exception for errors returned by Amazon Nova models"
-
-    def __init__(self, message):
-        self.message = message
+from img_generate.nova_canvas import ImageError, get_client, inpainting_request
 
 
 logger = logging.getLogger(__name__)
@@ -32,7 +20,8 @@ def inpaint_images(model_id,
                   height=None,
                   width=None,
                   cfg_scale=8.0,
-                  seed=0):
+                  seed=0,
+                  image_size=None):
     """
     Generate an inpainted image using Amazon Nova model.
     
@@ -47,17 +36,68 @@ def inpaint_images(model_id,
         width (int, optional): Width of output image (uses input image width by default).
         cfg_scale (float): Guidance scale for image generation.
         region_name (str): AWS region name.
+        image_size (dict, optional): Width and height of the first input image,
+            if already known, so it is not decoded again.
         
     Returns:
         bytes: The inpainted image generated by the model.
     """
     logger.info(f"Generating inpainted image with model {model_id}")
 
-    # Read and encode the input image
+    body = inpainting_body(prompt, mask_image, negative_prompt,
+                           base64_images, batch_count, cfg_scale, seed,
+                           image_size)
+    image_list = get_client(model_id).invoke_batch(body)
+
+    logger.info(
+        "Successfully inpainting %d images with Amazon Nova Canvas model %s",
+        len(image_list), model_id)
+
+    return image_list
+
+
+async def inpaint_images_async(model_id,
+                               task_id,
+                               prompt,
+                               mask_prompt=None,
+                               mask_image=None,
+                               negative_prompt=None,
+                               base64_images=None,
+                               batch_count=1,
+                               height=None,
+                               width=None,
+                               cfg_scale=8.0,
+                               seed=0,
+                               image_size=None,
+                               on_partial=None):
+    """
+    Async version of inpaint_images that does not block the event loop.
+    Large batches run as concurrent sub-requests; ``on_partial(start, images)``
+    is awaited as each one finishes.
+    """
+    logger.info(f"Generating inpainted image with model {model_id}")
+
+    body = inpainting_body(prompt, mask_image, negative_prompt,
+                           base64_images, batch_count, cfg_scale, seed,
+                           image_size)
+    image_list = await get_client(model_id).ainvoke_batch(body, on_partial)
+
+    logger.info(
+        "Successfully inpainting %d images with Amazon Nova Canvas model %s",
+        len(image_list), model_id)
+
+    return image_list
 
-    # Get image dimensions if not specified
 
-    if base64_images:
+def inpainting_body(prompt, mask_image, negative_prompt, base64_images,
+                    batch_count, cfg_scale, seed=None, image_size=None):
+    """
+    Build the INPAINTING request, sized to the first input image. Its size is
+    read from the image unless passed in ``image_size``.
+    """
+    if base64_images and image_size:
+        width, height = image_size["width"], image_size["height"]
+    elif base64_images:
         image_bytes = base64.b64decode(base64_images[0])
         
         image = Image.open(io.BytesIO(image_bytes))
@@ -66,61 +106,18 @@ def inpaint_images(model_id,
         raise ValueError(
             "Either height/width or input_image_path must be provided.")
 
-    # Prepare inpainting parameters
-    # logger.info("base64_images: %s", base64_images)
-    inpaint_params = {
-        "text": prompt,
-        "negativeText": negative_prompt,
-        "image": base64_images[0]
-    }
-
-    # Add either mask prompt or mask image (mask image takes precedence)
-    if mask_image:
-        inpaint_params["maskImage"] = mask_image
-    else:
+    # maskImage is required for inpainting with this model
+    if not mask_image:
         raise ValueError(
             "maskImage is required for inpainting with this model.")
 
-    # Create the full request body
-    body = json.dumps({
-        "taskType": "INPAINTING",
-        "inPaintingParams": inpaint_params,
-        "imageGenerationConfig": {
-            "numberOfImages": batch_count,
-            "height": height,
-            "width": width,
-            "cfgScale": cfg_scale,
-            # "seed": seed,
-        }
-    })
-
-    # Initialize Bedrock client
-    bedrock = boto3.client(
-        service_name='bedrock-runtime',
-        config=Config(read_timeout=300),
-        region_name='us-east-1'
-    )
-
-    # Call the model
-    response = bedrock.invoke_model(body=body,
-                                    modelId=model_id,
-                                    accept="application/json",
-                                    contentType="application/json")
-    response_body = json.loads(response.get("body").read())
-
-    # Check for errors
-    finish_reason = response_body.get("error")
-    if finish_reason is not None:
-        raise ImageError(f"Image generation error: {finish_reason}")
-
-    image_list = []
-    for base64_image in response_body.get("images", []):
-        base64_bytes = base64_image.encode('ascii')
-        image_bytes = base64.b64decode(base64_bytes)
-        image_list.append(image_bytes)
-
-    logger.info(
-        "Successfully inpainting %d images with Amazon Nova Canvas model %s",
-        len(image_list), model_id)
-
-    return image_list
+    body = inpainting_request(prompt,
+                              base64_images[0],
+                              mask_image,
+                              negative_prompt=negative_prompt,
+                              batch_count=batch_count,
+                              height=height,
+                              width=width,
+                              cfg_scale=cfg_scale,
+                              seed=seed)
+    return body
@@ -0,0 +1,298 @@
+import asyncio
+import base64
+import copy
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from img_generate.bedrock_client import get_bedrock_executor, get_bedrock_runtime
+from img_generate.bedrock_limiter import image_limiter
+
+logger = logging.getLogger(__name__)
+
+MODEL_ID = "amazon.nova-canvas-v1:0"
+
+TEXT_IMAGE = "TEXT_IMAGE"
+IMAGE_VARIATION = "IMAGE_VARIATION"
+INPAINTING = "INPAINTING"
+
+# Nova Canvas returns at most this many images per request
+MAX_IMAGES_PER_REQUEST = 5
+# Larger batches are split into concurrent requests of this many images
+GENERATION_SUBBATCH_SIZE = max(1, min(MAX_IMAGES_PER_REQUEST, int(os.getenv('GENERATION_SUBBATCH_SIZE', '2'))))
+# Valid seeds are 0 to 2147483646
+SEED_RANGE = 2147483647
+
+
+class ImageError(Exception):
+    "Custom exception for errors returned by Amazon Nova Canvas"
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _generation_config(batch_count: int, height: int, width: int,
+                       cfg_scale: float, seed: Optional[int] = None) -> Dict:
+    config = {
+        "numberOfImages": batch_count,
+        "height": height,
+        "width": width,
+        "cfgScale": cfg_scale,
+    }
+    if seed is not None:
+        config["seed"] = seed
+    return config
+
+
+def text_image_request(prompt: str, batch_count: int = 1, height: int = 1024,
+                       width: int = 1024, cfg_scale: float = 8.0,
+                       seed: Optional[int] = 0) -> Dict:
+    """
+    Build a TEXT_IMAGE request body.
+    """
+    return {
+        "taskType": TEXT_IMAGE,
+        "textToImageParams": {
+            "text": prompt
+        },
+        "imageGenerationConfig": _generation_config(
+            batch_count, height, width, cfg_scale, seed),
+    }
+
+
+def image_variation_request(prompt: str, base64_images: List[str],
+                            negative_prompt: Optional[str] = None,
+                            batch_count: int = 1, height: int = 1024,
+                            width: int = 1024, cfg_scale: float = 8.0,
+                            similarity_strength: float = 0.7,
+                            seed: Optional[int] = None) -> Dict:
+    """
+    Build an IMAGE_VARIATION request body.
+    """
+    params = {
+        "text": prompt,
+        "images": base64_images,
+        "similarityStrength": similarity_strength,  # Range: 0.2 to 1.0
+    }
+    if negative_prompt is not None:
+        params["negativeText"] = negative_prompt
+    return {
+        "taskType": IMAGE_VARIATION,
+        "imageVariationParams": params,
+        "imageGenerationConfig": _generation_config(
+            batch_count, height, width, cfg_scale, seed),
+    }
+
+
+def inpainting_request(prompt: str, base64_image: str, mask_image: str,
+                       negative_prompt: Optional[str] = None,
+                       batch_count: int = 1, height: int = 1024,
+                       width: int = 1024, cfg_scale: float = 8.0,
+                       seed: Optional[int] = None) -> Dict:
+    """
+    Build an INPAINTING request body. ``mask_image`` is a base64 encoded
+    black and white mask, black marking the area to repaint.
+    """
+    return {
+        "taskType": INPAINTING,
+        "inPaintingParams": {
+            "text": prompt,
+            "negativeText": negative_prompt,
+            "image": base64_image,
+            "maskImage": mask_image,
+        },
+        "imageGenerationConfig": _generation_config(
+            batch_count, height, width, cfg_scale, seed),
+    }
+
+
+def derive_seed(seed, index: int):
+    """
+    Seed for the ``index``-th sub-request of a split batch. The first one
+    keeps the original seed, so small batches generate what they always did.
+    """
+    if seed is None:
+        return None
+    return (int(seed) + index * 7919) % SEED_RANGE
+
+
+def split_request(body: Dict, size: int = GENERATION_SUBBATCH_SIZE) -> List[Dict]:
+    """
+    Split a request for many images into requests for at most ``size``
+    images each, with derived seeds.
+    """
+    config = body["imageGenerationConfig"]
+    total = config["numberOfImages"]
+    if total <= size:
+        return [body]
+    bodies = []
+    for index, start in enumerate(range(0, total, size)):
+        part = copy.copy(body)
+        part["imageGenerationConfig"] = dict(
+            config, numberOfImages=min(size, total - start))
+        seed = derive_seed(config.get("seed"), index)
+        if seed is not None:
+            part["imageGenerationConfig"]["seed"] = seed
+        bodies.append(part)
+    return bodies
+
+
+def decode_images(response_body: Dict) -> List[bytes]:
+    """
+    Turn a Nova Canvas response body into raw image bytes.
+    Raises:
+        ImageError: If the model reported an error.
+    """
+    finish_reason = response_body.get("error")
+    if finish_reason is not None:
+        raise ImageError(f"Image generation error. Error is {finish_reason}")
+
+    return [base64.b64decode(base64_image)
+            for base64_image in response_body.get("images", [])]
+
+
+class NovaCanvasClient:
+    """
+    Single request path for Amazon Nova Canvas.
+
+    Timing hooks are called after every invocation as
+    ``hook(task_type, elapsed_seconds, image_count, error)``, where
+    ``image_count`` is 0 and ``error`` the raised exception on failure.
+    Calls go through the shared Nova Canvas limiter unless another
+    ``limiter`` is given.
+    """
+
+    def __init__(self, model_id: str = MODEL_ID, bedrock=None, limiter=None):
+        self.model_id = model_id
+        self._bedrock = bedrock
+        self._limiter = limiter
+        self._timing_hooks: List[Callable] = []
+
+    @property
+    def bedrock(self):
+        return self._bedrock or get_bedrock_runtime()
+
+    @property
+    def limiter(self):
+        return self._limiter or image_limiter()
+
+    def add_timing_hook(self, hook: Callable):
+        self._timing_hooks.append(hook)
+
+    def invoke(self, body: Dict) -> List[bytes]:
+        """
+        Send a request body built by one of the ``*_request`` helpers.
+        Returns:
+            list: Raw bytes of every generated image.
+        """
+        task_type = body["taskType"]
+        started = time.perf_counter()
+        try:
+            response = self.limiter.call(
+                self.bedrock.invoke_model,
+                body=json.dumps(body),
+                modelId=self.model_id,
+                accept="application/json",
+                contentType="application/json")
+            image_list = decode_images(json.loads(response.get("body").read()))
+        except Exception as e:
+            self._report(task_type, time.perf_counter() - started, 0, e)
+            raise
+        self._report(task_type, time.perf_counter() - started,
+                     len(image_list), None)
+        return image_list
+
+    async def ainvoke(self, body: Dict) -> List[bytes]:
+        """
+        Awaitable ``invoke``. The blocking call runs on the shared Bedrock
+        executor so the event loop stays free while the model works.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_bedrock_executor(),
+                                          self.invoke, body)
+
+    def invoke_batch(self, body: Dict,
+                     size: int = GENERATION_SUBBATCH_SIZE) -> List[bytes]:
+        """
+        Like ``invoke``, but requests for more than ``size`` images are sent
+        as several smaller requests, one after another.
+        """
+        return [image for part in split_request(body, size)
+                for image in self.invoke(part)]
+
+    async def ainvoke_batch(self, body: Dict, on_partial: Optional[Callable] = None,
+                            size: int = GENERATION_SUBBATCH_SIZE) -> List[bytes]:
+        """
+        Like ``ainvoke``, but a request for more than ``size`` images is sent
+        as concurrent sub-requests (see ``split_request``).
+
+        ``on_partial(start, images)`` is awaited as each sub-request finishes,
+        with ``start`` the position of its first image in the final list.
+        Once one sub-request fails, the rest are no longer reported, and the
+        first error is raised only after all of them have finished, so
+        nothing is saved for the request after it failed.
+        Returns:
+            list: Raw bytes of every image, in sub-request order.
+        """
+        bodies = split_request(body, size)
+        results = [None] * len(bodies)
+        starts = []
+        start = 0
+        for part in bodies:
+            starts.append(start)
+            start += part["imageGenerationConfig"]["numberOfImages"]
+
+        failed = False
+
+        async def run(index):
+            nonlocal failed
+            try:
+                results[index] = await self.ainvoke(bodies[index])
+                if on_partial is not None and not failed:
+                    await on_partial(starts[index], results[index])
+            except Exception:
+                failed = True
+                raise
+
+        if len(bodies) > 1:
+            logger.info("Splitting %d images into %d requests",
+                        start, len(bodies))
+        outcomes = await asyncio.gather(
+            *(run(index) for index in range(len(bodies))),
+            return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return [image for images in results for image in images]
+
+    def _report(self, task_type, elapsed, image_count, error):
+        for hook in self._timing_hooks:
+            try:
+                hook(task_type, elapsed, image_count, error)
+            except Exception:
+                logger.exception("Timing hook failed")
+
+
+def log_timing(task_type, elapsed, image_count, error):
+    if error is None:
+        logger.info("%s returned %d images in %.2fs",
+                    task_type, image_count, elapsed)
+    else:
+        logger.warning("%s failed after %.2fs: %s", task_type, elapsed, error)
+
+
+_clients = {}
+
+
+def get_client(model_id: str = MODEL_ID) -> NovaCanvasClient:
+    """
+    Get the shared NovaCanvasClient for a model id.
+    """
+    client = _clients.get(model_id)
+    if client is None:
+        client = NovaCanvasClient(model_id)
+        client.add_timing_hook(log_timing)
+        client = _clients.setdefault(model_id, client)
+    return client
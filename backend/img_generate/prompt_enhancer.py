@@ -1,7 +1,12 @@
-import boto3
+import asyncio
 import json
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+from img_generate.bedrock_client import get_bedrock_executor, get_bedrock_runtime
+from img_generate.bedrock_limiter import text_limiter
 
 # --- Configuration ---
 # Choose the AWS region where you have Bedrock model access
@@ -17,18 +22,16 @@ AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
 MODEL_ID = "amazon.nova-pro-v1:0"
 # MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
 
+# Enhanced prompts are cached per (model, normalized prompt)
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "1024"))
+PROMPT_CACHE_TTL = float(os.environ.get("PROMPT_CACHE_TTL", str(24 * 3600)))
+
 # --- Bedrock Client Initialization ---
 try:
     # It's better practice to let Boto3 find credentials via standard methods
     # (env vars, shared credential file, IAM role) rather than hardcoding.
-    bedrock_runtime = boto3.client(
-        service_name='bedrock-runtime',
-        region_name=AWS_REGION
-        # If explicit credentials needed (less secure, avoid if possible):
-        # aws_access_key_id=YOUR_ACCESS_KEY,
-        # aws_secret_access_key=YOUR_SECRET_KEY,
-        # aws_session_token=YOUR_SESSION_TOKEN # Optional
-    )
+    # Shared, pooled client (see bedrock_client.py)
+    bedrock_runtime = get_bedrock_runtime(AWS_REGION)
 except Exception as e:
     print(f"Error initializing Bedrock client: {e}")
     print("Please ensure your AWS credentials and region are configured correctly,")
@@ -47,6 +50,24 @@ def enhance_pc_case_prompt(original_prompt: str, model_id: str = MODEL_ID) -> st
     Returns:
         The enhanced, detailed prompt string, or an error message.
     """
+    try:
+        return _enhance(original_prompt, model_id)
+    except Exception as e:
+        return _error_message(e, model_id)
+
+
+def _enhance(original_prompt: str, model_id: str) -> str:
+    """
+    Run one enhancement against Bedrock. Blocking; raises on failure.
+    """
+    return "".join(stream_pc_case_prompt(original_prompt, model_id))
+
+
+def stream_pc_case_prompt(original_prompt: str, model_id: str = MODEL_ID):
+    """
+    Enhance a prompt, yielding the text deltas as Bedrock streams them.
+    Blocking; raises on failure.
+    """
     print(f"Original Prompt: '{original_prompt}'")
     print(f"Using model: {model_id}")
 
@@ -68,33 +89,164 @@ def enhance_pc_case_prompt(original_prompt: str, model_id: str = MODEL_ID) -> st
 
 
     # --- Invoke Bedrock Model ---
+    user_message = system_prompt+f"Enhance the following PC case design idea into a detailed image generation prompt:\n\n'{original_prompt}'"
+    conversation = [
+    {
+    "role": "user",
+    "content": [{"text": user_message}],
+    }
+    ]
+
+    print("Invoking Bedrock model...")
+    # Admission control and retries on throttling (see bedrock_limiter.py).
+    # The slot is held until the whole response has been streamed.
+    stream = text_limiter().stream(
+    bedrock_runtime.converse_stream,
+    modelId=model_id,
+    messages=conversation,
+    inferenceConfig={"maxTokens": 200, "temperature": 0.5, "topP": 0.9},
+    )
     try:
-        user_message = system_prompt+f"Enhance the following PC case design idea into a detailed image generation prompt:\n\n'{original_prompt}'"
-        conversation = [
-        {
-        "role": "user",
-        "content": [{"text": user_message}],
-        }
-        ]
-
-        print("Invoking Bedrock model...")
-        streaming_response = bedrock_runtime.converse_stream(
-        modelId=model_id,
-        messages=conversation,
-        inferenceConfig={"maxTokens": 200, "temperature": 0.5, "topP": 0.9},
-        )
-        result=""
-         # Extract and print the streamed response text in real-time.
-        for chunk in streaming_response["stream"]:
+        # Extract and print the streamed response text in real-time.
+        for chunk in stream:
             if "contentBlockDelta" in chunk:
                 text = chunk["contentBlockDelta"]["delta"]["text"]
                 print(text, end="")
-                result+=text
-        return result
-    except bedrock_runtime.exceptions.AccessDeniedException as e:
+                yield text
+    finally:
+        stream.close()
+
+
+def _error_message(error: Exception, model_id: str) -> str:
+    if isinstance(error, bedrock_runtime.exceptions.AccessDeniedException):
         print(f"Error: Access Denied. Ensure the correct IAM permissions and model access for {model_id} in region {AWS_REGION}.")
-        print(f"Details: {e}")
+        print(f"Details: {error}")
         return f"Error: Access Denied for model {model_id}."
+    print(f"Error invoking Bedrock model {model_id}: {error}")
+    return f"Error: An unexpected error occurred: {error}"
+
+
+# --- Cached, non-blocking enhancement for the API server ---
+# (model_id, normalized prompt) -> (enhanced prompt, time cached)
+_prompt_cache = OrderedDict()
+# Enhancements in flight, shared by concurrent identical requests
+_in_flight = {}
+_prompt_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Prompts differing only in case or whitespace are enhanced once.
+    """
+    return " ".join(prompt.split()).casefold()
+
+
+async def enhance_pc_case_prompt_async(original_prompt: str, model_id: str = MODEL_ID) -> str:
+    """
+    Async version of enhance_pc_case_prompt for use on the event loop.
+
+    The Bedrock call runs on the shared Bedrock executor. Results are kept
+    in an LRU cache keyed by model and normalized prompt, and concurrent
+    requests for the same key wait for a single call. Failures are not
+    cached.
+
+    Returns:
+        The enhanced, detailed prompt string, or an error message.
+    """
+    key = (model_id, normalize_prompt(original_prompt))
+    cached = _prompt_cache.get(key)
+    if cached is not None and time.time() - cached[1] <= PROMPT_CACHE_TTL:
+        _prompt_cache.move_to_end(key)
+        _prompt_cache_stats["hits"] += 1
+        return cached[0]
+
+    in_flight = _in_flight.get(key)
+    if in_flight is not None:
+        _prompt_cache_stats["coalesced"] += 1
+        try:
+            return await asyncio.shield(in_flight)
+        except Exception as e:
+            return _error_message(e, model_id)
+
+    _prompt_cache_stats["misses"] += 1
+    loop = asyncio.get_running_loop()
+    in_flight = loop.run_in_executor(get_bedrock_executor(), _enhance,
+                                     original_prompt, model_id)
+    _in_flight[key] = in_flight
+    try:
+        result = await asyncio.shield(in_flight)
     except Exception as e:
-        print(f"Error invoking Bedrock model {model_id}: {e}")
-        return f"Error: An unexpected error occurred: {e}"
+        return _error_message(e, model_id)
+    finally:
+        if _in_flight.get(key) is in_flight:
+            del _in_flight[key]
+
+    _cache_prompt(key, result)
+    return result
+
+
+async def stream_pc_case_prompt_async(original_prompt: str, model_id: str = MODEL_ID):
+    """
+    Async generator over the enhanced prompt's text deltas, for streaming
+    to clients. A cached prompt is yielded in one piece. Completed
+    enhancements are added to the cache.
+
+    Raises:
+        Exception: Whatever the Bedrock call raised; deltas already yielded
+            stay valid.
+    """
+    key = (model_id, normalize_prompt(original_prompt))
+    cached = _prompt_cache.get(key)
+    if cached is not None and time.time() - cached[1] <= PROMPT_CACHE_TTL:
+        _prompt_cache.move_to_end(key)
+        _prompt_cache_stats["hits"] += 1
+        yield cached[0]
+        return
+
+    _prompt_cache_stats["misses"] += 1
+    loop = asyncio.get_running_loop()
+    deltas = asyncio.Queue()
+    cancelled = threading.Event()
+    done = object()
+
+    def produce():
+        # Runs on the Bedrock executor, handing deltas to the event loop
+        try:
+            for text in stream_pc_case_prompt(original_prompt, model_id):
+                if cancelled.is_set():
+                    return
+                loop.call_soon_threadsafe(deltas.put_nowait, text)
+        except Exception as e:
+            loop.call_soon_threadsafe(deltas.put_nowait, e)
+            return
+        loop.call_soon_threadsafe(deltas.put_nowait, done)
+
+    loop.run_in_executor(get_bedrock_executor(), produce)
+    result = ""
+    try:
+        while True:
+            item = await deltas.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            result += item
+            yield item
+    finally:
+        # Stop reading from Bedrock if the client went away
+        cancelled.set()
+
+    _cache_prompt(key, result)
+
+
+def _cache_prompt(key, result):
+    if not result:
+        return
+    _prompt_cache[key] = (result, time.time())
+    _prompt_cache.move_to_end(key)
+    while len(_prompt_cache) > PROMPT_CACHE_SIZE:
+        _prompt_cache.popitem(last=False)
+
+
+def prompt_cache_stats():
+    return dict(_prompt_cache_stats, entries=len(_prompt_cache))
@@ -0,0 +1,44 @@
+import base64
+import json
+import os
+
+# Page sizes for /projects and /templates listings, and for the images of
+# a single project
+LISTING_PAGE_SIZE = int(os.getenv('LISTING_PAGE_SIZE', '50'))
+LISTING_MAX_PAGE_SIZE = int(os.getenv('LISTING_MAX_PAGE_SIZE', '200'))
+PROJECT_IMAGE_PAGE_SIZE = int(os.getenv('PROJECT_IMAGE_PAGE_SIZE', '100'))
+
+
+class CursorError(ValueError):
+    "Raised for a pagination cursor that was not issued by this API"
+
+
+def encode_cursor(*values):
+    """
+    Opaque cursor holding the sort key of the last item on a page.
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    """
+    Returns:
+        list: The ``length`` values stored by encode_cursor().
+    Raises:
+        CursorError: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise CursorError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise CursorError("Invalid cursor")
+    return values
+
+
+def page_size(limit, default=LISTING_PAGE_SIZE):
+    if limit is None:
+        return default
+    return max(1, min(limit, LISTING_MAX_PAGE_SIZE))
@@ -0,0 +1,62 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# "proxy" streams image bytes through the API, "redirect" answers image and
+# thumbnail requests with a short-lived presigned S3 URL instead.
+IMAGE_DELIVERY = os.getenv('IMAGE_DELIVERY', 'proxy')
+PRESIGNED_URL_TTL = int(os.getenv('PRESIGNED_URL_TTL', '900'))
+# A cached URL is replaced once it has less than this many seconds left
+PRESIGNED_URL_MARGIN = int(os.getenv('PRESIGNED_URL_MARGIN', '60'))
+PRESIGNED_URL_CACHE_SIZE = int(os.getenv('PRESIGNED_URL_CACHE_SIZE', '10000'))
+
+
+class PresignedUrlCache:
+    """
+    Presigned GET URLs for S3 objects, reused until shortly before they
+    expire.
+    """
+
+    def __init__(self, s3_client, bucket, ttl=PRESIGNED_URL_TTL,
+                 margin=PRESIGNED_URL_MARGIN,
+                 max_entries=PRESIGNED_URL_CACHE_SIZE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.ttl = ttl
+        self.margin = min(margin, ttl // 2)
+        self.max_entries = max_entries
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def url(self, key, content_type=None):
+        """
+        Returns:
+            tuple: (url, seconds the URL stays usable for clients).
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._urls.get(key)
+            if cached and cached[1] - self.margin > now:
+                self._urls.move_to_end(key)
+                return cached[0], int(cached[1] - self.margin - now)
+
+        params = {"Bucket": self.bucket, "Key": key}
+        if content_type:
+            params["ResponseContentType"] = content_type
+        url = self.s3_client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=self.ttl)
+        expires_at = now + self.ttl
+        with self._lock:
+            self._urls[key] = (url, expires_at)
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return url, self.ttl - self.margin
+
+    def invalidate(self, key):
+        with self._lock:
+            self._urls.pop(key, None)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Model output for deterministic requests is kept on disk under
+# GENERATION_CACHE_DIR; an empty value disables the cache.
+GENERATION_CACHE_DIR = os.getenv('GENERATION_CACHE_DIR', 'generation_cache')
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv('GENERATION_CACHE_MAX_ENTRIES', '1000'))
+GENERATION_CACHE_MAX_BYTES = int(os.getenv('GENERATION_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+# Seconds a result may be reused for
+GENERATION_CACHE_TTL = float(os.getenv('GENERATION_CACHE_TTL', str(7 * 24 * 3600)))
+
+
+def request_key(**fields):
+    """
+    Canonical hash of a generation request. Field order and JSON formatting
+    do not matter; values must be JSON serializable.
+    """
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"),
+                           ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Disk-backed cache of generated images keyed by request_key().
+
+    Each entry is a directory holding the raw images returned by the model,
+    so a repeated request can be answered without calling Bedrock. Entries
+    expire after ``ttl`` seconds and the least recently used ones are
+    dropped beyond ``max_entries`` or ``max_bytes``. Safe to use from
+    several threads.
+    """
+
+    def __init__(self, directory=GENERATION_CACHE_DIR,
+                 max_entries=GENERATION_CACHE_MAX_ENTRIES,
+                 max_bytes=GENERATION_CACHE_MAX_BYTES,
+                 ttl=GENERATION_CACHE_TTL):
+        self.directory = directory or None
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (created, size), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def get(self, key):
+        """
+        Returns:
+            list: The cached images as bytes, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                self._misses += 1
+                stale = entry is not None
+            else:
+                self._entries.move_to_end(key)
+                stale = False
+        if entry is None:
+            return None
+        if stale:
+            self._remove(key)
+            return None
+        try:
+            with open(os.path.join(self._path(key), "meta.json"), encoding="utf-8") as f:
+                count = json.load(f)["count"]
+            images = []
+            for index in range(count):
+                with open(os.path.join(self._path(key), f"{index}.bin"), "rb") as f:
+                    images.append(f.read())
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable generation cache entry {key}: {str(e)}")
+            self._remove(key)
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            self._hits += 1
+        return images
+
+    def put(self, key, images):
+        if not self.enabled or not images:
+            return
+        size = sum(len(image) for image in images)
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        created = time.time()
+        try:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            for index, image in enumerate(images):
+                with open(os.path.join(tmp_path, f"{index}.bin"), "wb") as f:
+                    f.write(image)
+            with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"count": len(images), "created": created}, f)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write generation cache entry {key}: {str(e)}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (created, size)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes) and len(self._entries) > 1:
+                evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            shutil.rmtree(self._path(evicted_key), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                    meta = json.load(f)
+                size = sum(os.path.getsize(os.path.join(path, f"{index}.bin"))
+                           for index in range(meta["count"]))
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((meta["created"], name, size))
+        # Oldest first, so eviction starts with them
+        for created, key, size in sorted(entries):
+            self._entries[key] = (created, size)
+            self._bytes += size
@@ -1,9 +1,10 @@
 import json
+import hashlib
 import traceback
 import random
 import boto3
-from fastapi import FastAPI, UploadFile, Form, HTTPException, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, Form, HTTPException, File, Header, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional, Dict
 from datetime import datetime
 import os
@@ -12,16 +13,40 @@ import mysql.connector
 import uuid
 from datetime import datetime
 from fastapi.staticfiles import StaticFiles
-from img_generate.img_generator import generate_images, save_images, get_image_size, process_images
-from img_generate.img_inpainting import inpaint_images
-from img_generate.prompt_enhancer import enhance_pc_case_prompt
+from img_generate.img_generator import (generate_images_async, save_images, get_image_size,
+                                       process_images_async, encode_images, media_type)
+from img_generate.img_inpainting import inpaint_images_async
+from img_generate.nova_canvas import SEED_RANGE
+from img_generate.bedrock_limiter import limiter_stats
+from img_generate.prompt_enhancer import (enhance_pc_case_prompt_async,
+                                          prompt_cache_stats,
+                                          stream_pc_case_prompt_async)
+from task_queue import TaskQueue, QueueFullError
+from task_store import FINISHED_STATUSES, TASK_LEASE, create_task_store
+from task_events import (TASK_EVENTS_KEEPALIVE, TASK_EVENTS_POLL_INTERVAL,
+                         TaskEvents, sse_event)
+from db import ConnectionPool, ensure_index
+from image_cache import (IMAGE_STREAM_BUFFER_BYTES, IMAGE_STREAM_CACHE_MAX_BYTES,
+                         ByteBudget, ImageCache, content_etag)
+from thumbnails import THUMB_MEDIA_TYPE, render_thumbnail, thumb_key
+from http_cache import (etag_matches, http_date, is_not_modified,
+                        not_modified_response, row_etag)
+from email.utils import parsedate_to_datetime
+from fastapi.encoders import jsonable_encoder
+from presign import IMAGE_DELIVERY, PresignedUrlCache
+from blobs import (add_blob, copy_project_images, ensure_schema,
+                   new_blob_key, release_refs)
+from blob_gc import BlobCollector
+from result_cache import ResultCache, request_key
+from pagination import (PROJECT_IMAGE_PAGE_SIZE, CursorError, decode_cursor,
+                        encode_cursor, page_size)
+from botocore.exceptions import ClientError
 import uuid
-import threading
 import asyncio
 import logging
 import base64
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import Response, RedirectResponse
 
 load_dotenv()
 
@@ -52,131 +77,391 @@ app.mount("/static",
 
 model_id = "amazon.nova-canvas-v1:0"
 
-image_tasks = {}
-image_tasks_lock = threading.Lock()
+IMAGE_STREAM_CHUNK_SIZE = int(os.getenv('IMAGE_STREAM_CHUNK_SIZE', str(64 * 1024)))
 
-task_result = dict()
+task_store = create_task_store()
+task_queue = TaskQueue()
+task_events = TaskEvents()
+result_cache = ResultCache()
 
 
-def run_image_generation_task(task_id, text, imgs, batch_count, height, width,
-                              cfg_scale, seed, similarityStrength):
+@app.on_event("startup")
+async def prepare_schema():
+    def run_query(conn):
+        ensure_schema(conn)
+        # Keyset pagination of /projects and /templates
+        ensure_index(conn, "projects", "projects_listing",
+                     ["readonly", "modified_at", "id"])
+
+    await db_pool.run(run_query)
+
+
+@app.on_event("startup")
+async def start_blob_collector():
+    blob_collector.start()
+
+
+@app.on_event("shutdown")
+async def stop_blob_collector():
+    await blob_collector.stop()
+
+
+@app.on_event("startup")
+async def start_task_queue():
+    task_queue.start()
+    await resume_pending_tasks()
+
+
+@app.on_event("shutdown")
+async def stop_task_queue():
+    await task_queue.stop()
+
+
+def queue_full_response(error):
+    logger.warning(error.message)
+    return JSONResponse(
+        status_code=503,
+        content={"error": error.message},
+        headers={"Retry-After": "5"}
+    )
+
+
+async def resume_pending_tasks():
+    """
+    Re-queue tasks left in "queued" state by a previous run, and "running"
+    tasks whose lease ran out because their process died. Other workers may
+    pick up the same tasks; claim() makes sure each one runs only once.
+    """
+    stale = await asyncio.to_thread(task_store.requeue_stale, TASK_LEASE)
+    if stale:
+        logger.warning(f"Re-queued {stale} generation tasks abandoned while running")
+    resumed = 0
+    for task_id, kind, payload in await asyncio.to_thread(task_store.pending):
+        try:
+            task_queue.submit(task_id, run_task, kind, payload)
+        except QueueFullError:
+            logger.warning("Generation queue full, leaving remaining tasks queued")
+            break
+        resumed += 1
+    if resumed:
+        logger.info(f"Resumed {resumed} queued generation tasks")
+
+
+async def update_task(task_id, **fields):
+    """
+    Update a task and push its new state to clients streaming its events.
+    """
+    def update():
+        task_store.update(task_id, **fields)
+        return task_store.get(task_id)
+
+    task_events.publish(task_id, await asyncio.to_thread(update))
+
+
+async def keep_task_lease(task_id):
+    # Refresh updated_at so resume_pending_tasks() in another process does
+    # not take a long generation for an abandoned one
+    while True:
+        await asyncio.sleep(TASK_LEASE / 3)
+        await asyncio.to_thread(task_store.update, task_id)
+
+
+async def run_task(task_id, kind, payload):
+    if not await asyncio.to_thread(task_store.claim, task_id):
+        # Already taken by another worker or no longer queued
+        return
+    task_events.publish(task_id, await asyncio.to_thread(task_store.get, task_id))
+    lease = asyncio.create_task(keep_task_lease(task_id))
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            generate_image_logic(task_id, text, imgs, batch_count, height,
-                                 width, cfg_scale, seed, similarityStrength))
-        loop.close()
-
-        with image_tasks_lock:
-            image_tasks[task_id]["status"] = "done"
-            image_tasks[task_id]["result"] = result
+        saved_paths = await TASK_JOBS[kind](task_id, **payload)
+        await update_task(task_id, status="done", urls=saved_paths, payload=None)
+    except asyncio.CancelledError:
+        # Shutting down: hand the task back so the next start runs it again.
+        # Written synchronously since this task can no longer await.
+        logger.warning(f"Task {task_id} interrupted, returning it to the queue")
+        task_store.update(task_id, status="queued", urls=None)
+        raise
     except Exception as e:
-        with image_tasks_lock:
-            image_tasks[task_id]["status"] = "error"
-            
-            logger.error(str(e))
-            logger.error(traceback.format_exc())
-            image_tasks[task_id]["error"] = str(e)
+        logger.error(str(e))
+        logger.error(traceback.format_exc())
+        await update_task(task_id, status="error", error=str(e), payload=None)
+    finally:
+        lease.cancel()
 
 
-def run_image_inpainting_task(task_id, batch_count, text, imgs, mask_prompt,
-                              mask_image, negative_prompt, height, width,
-                              cfg_scale, seed):
+async def submit_task(kind, payload):
+    """
+    Record a new task and hand it to the generation queue.
+    Returns:
+        dict: The task id, or a 503 response if the queue is full.
+    """
+    task_id = str(uuid.uuid4())  # Generate a unique task ID
+
+    task = await asyncio.to_thread(task_store.create, task_id, kind, payload)
+    logger.info(f"Received image {kind} task: {task_id}, {task}")
+
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            inpainting_image_logic(task_id, batch_count, text, imgs,
-                                   mask_prompt, mask_image, negative_prompt,
-                                   height, width, cfg_scale, seed))
-        loop.close()
-
-        with image_tasks_lock:
-            image_tasks[task_id]["status"] = "done"
-            image_tasks[task_id]["result"] = result
-    except Exception as e:
-        with image_tasks_lock:
-            image_tasks[task_id]["status"] = "error"
-            
-            logger.error(str(e))
-            logger.error(traceback.format_exc())
-            image_tasks[task_id]["error"] = str(e)
+        task_queue.submit(task_id, run_task, kind, payload)
+    except QueueFullError as e:
+        await asyncio.to_thread(task_store.delete, task_id)
+        return queue_full_response(e)
+
+    return {"id": task_id}
 
 async def generate_image_logic(task_id, text, imgs, batch_count, height, width,
-                               cfg_scale, seed, similarityStrength):
+                               cfg_scale, seed, similarityStrength,
+                               cacheable=False, projectId=None):
+    results = TaskResults(task_id, projectId, seed=seed, prompt=text)
+    inputs = TaskInputs(imgs)
+    cache_key = None
+    if cacheable and result_cache.enabled:
+        cache_key = await generation_cache_key(
+            "generation", inputs, text=text, batch_count=batch_count,
+            height=height, width=width, cfg_scale=cfg_scale, seed=seed,
+            similarity_strength=similarityStrength)
+        cached = await cached_result(results, cache_key)
+        if cached is not None:
+            return cached
 
     if imgs:
-        # uploaded_image_bytes = [await img.read() for img in imgs]
-        uploaded_image_bytes = []
-        for img_id in imgs:
-            img_base64 = await getImageDataB64Async(img_id)
-            if img_base64:
-                uploaded_image_bytes.append(img_base64)
-
+        await inputs.fetch()
 
         # 可依第一張圖片大小補高度寬度
         if not height or not width:
-            first_image_size = await get_image_size(uploaded_image_bytes[0])
+            first_image_size = inputs.sizes()[0]
             height = height or first_image_size["height"]
             width = width or first_image_size["width"]
 
-        img_list = process_images(model_id=model_id,
+        img_list = await process_images_async(
+                                  model_id=model_id,
                                   task_id=task_id,
                                   prompt=text,
-                                  base64_images=uploaded_image_bytes,
+                                  base64_images=inputs.base64_images(),
                                   batch_count=batch_count,
                                   height=height,
                                   width=width,
                                   cfg_scale=cfg_scale,
                                   seed=seed,
-                                  similarityStrength=similarityStrength)
+                                  similarityStrength=similarityStrength,
+                                  on_partial=results.save)
     else:
-        img_list = generate_images(model_id=model_id,
+        img_list = await generate_images_async(
+                                   model_id=model_id,
                                    task_id=task_id,
                                    prompt=text,
                                    batch_count=batch_count,
                                    height=height,
                                    width=width,
                                    cfg_scale=cfg_scale,
-                                   seed=seed)
-    saved_paths = save_images(task_id, img_list)
-    task_result[task_id] = saved_paths
+                                   seed=seed,
+                                   on_partial=results.save)
+    if cache_key:
+        await asyncio.to_thread(result_cache.put, cache_key, img_list)
+    return results.paths()
 
 
 async def inpainting_image_logic(task_id, batch_count, text, imgs, mask_prompt,
                            mask_image, negative_prompt, height, width,
-                           cfg_scale, seed):
+                           cfg_scale, seed, cacheable=False, projectId=None):
+    results = TaskResults(task_id, projectId, seed=seed, prompt=text)
+    inputs = TaskInputs(imgs)
+    cache_key = None
+    if cacheable and result_cache.enabled:
+        cache_key = await generation_cache_key(
+            "inpainting", inputs, text=text, batch_count=batch_count,
+            height=height, width=width, cfg_scale=cfg_scale, seed=seed,
+            mask_prompt=mask_prompt, negative_prompt=negative_prompt,
+            mask_image=hashlib.sha256(mask_image.encode("utf-8")).hexdigest()
+            if mask_image else None)
+        cached = await cached_result(results, cache_key)
+        if cached is not None:
+            return cached
+
+    image_size = None
     if imgs:
-        # uploaded_image_bytes = [await img.read() for img in imgs]
-        uploaded_image_bytes = []
-        for img_id in imgs:
-            img_base64 = await getImageDataB64Async(img_id)
-            
-            if img_base64:
-                uploaded_image_bytes.append(img_base64)
+        await inputs.fetch()
 
         # 可依第一張圖片大小補高度寬度
+        image_size = inputs.sizes()[0]
         if not height or not width:
-            first_image_size = await get_image_size(uploaded_image_bytes[0])
-            height = height or first_image_size["height"]
-            width = width or first_image_size["width"]
+            height = height or image_size["height"]
+            width = width or image_size["width"]
 
-    
-    img_list = inpaint_images(model_id=model_id,
+    img_list = await inpaint_images_async(
+                                 model_id=model_id,
                                  task_id=task_id,
                                  prompt=text,
                                  mask_prompt=mask_prompt,
                                  mask_image=mask_image,
                                  negative_prompt=negative_prompt,
-                                 base64_images=uploaded_image_bytes,
+                                 base64_images=inputs.base64_images(),
                                  batch_count=batch_count,
                                  height=height,
                                  width=width,
                                  cfg_scale=cfg_scale,
-                                 seed=seed)
-    saved_paths = save_images(task_id, img_list)
-    task_result[task_id] = saved_paths
+                                 seed=seed,
+                                 image_size=image_size,
+                                 on_partial=results.save)
+    if cache_key:
+        await asyncio.to_thread(result_cache.put, cache_key, img_list)
+    return results.paths()
+
+
+class TaskResults:
+    """
+    Saves a task's images as its sub-requests finish and publishes the
+    paths saved so far, in final order, so clients see the first images
+    before the whole batch is done.
+
+    With a ``project_id`` the images go straight into that project (S3 and
+    the images table) and their paths are ``/img/{imageId}/file``;
+    otherwise they are written to generated_images/. Image IDs are derived
+    from the task and position, so a task re-run after an interruption does
+    not add the images it already saved a second time.
+    """
+
+    def __init__(self, task_id, project_id=None, seed=None, prompt=None):
+        self.task_id = task_id
+        self.project_id = project_id
+        self.seed = seed
+        self.prompt = prompt
+        self._saved = {}
+
+    async def save(self, start, images):
+        if self.project_id:
+            images = await asyncio.to_thread(encode_images, images)
+            image_ids = [str(uuid.uuid5(uuid.NAMESPACE_URL,
+                                        f"task:{self.task_id}/{start + index}"))
+                         for index in range(len(images))]
+            image_ids = await persist_images(self.project_id, images,
+                                             seed=self.seed,
+                                             prompt=self.prompt,
+                                             image_ids=image_ids)
+            self._saved[start] = [f"/img/{image_id}/file"
+                                  for image_id in image_ids]
+        else:
+            self._saved[start] = await asyncio.to_thread(
+                save_images, self.task_id, images, start_index=start)
+        await update_task(self.task_id, urls=self.paths())
+
+    def paths(self):
+        return [path for start in sorted(self._saved)
+                for path in self._saved[start]]
+
+
+class TaskInputs:
+    """
+    A task's input images, looked up and fetched once and shared by every
+    step that needs them.
+
+    All blob keys come from one query, the blobs are fetched concurrently
+    (duplicates once), and each image's base64 form and size are computed
+    in the same worker thread as its fetch, reading only the image header.
+    """
+
+    def __init__(self, image_ids):
+        self.image_ids = list(image_ids or [])
+        self._blob_keys = None
+        # blob key -> {"base64": str, "size": {"width", "height"}}
+        self._images = None
+
+    async def blob_keys(self):
+        """
+        Returns:
+            list: The blob key of each input image, None for unknown IDs.
+        """
+        if self._blob_keys is None:
+            if not self.image_ids:
+                self._blob_keys = []
+                return self._blob_keys
+
+            image_ids = self.image_ids
+
+            def run_query(conn):
+                cursor = conn.cursor()
+                placeholders = ", ".join(["%s"] * len(image_ids))
+                cursor.execute(
+                    f"SELECT id, blob_key FROM images WHERE id IN ({placeholders})",
+                    tuple(image_ids))
+                found = dict(cursor.fetchall())
+                cursor.close()
+                return found
+
+            found = await db_pool.run(run_query)
+            self._blob_keys = [found.get(image_id) for image_id in image_ids]
+        return self._blob_keys
+
+    async def fetch(self):
+        """
+        Load every input image.
+        Raises:
+            HTTPException: 404 for an unknown image ID, 500 if S3 fails.
+        """
+        if self._images is not None:
+            return
+        blob_keys = await self.blob_keys()
+        for image_id, blob_key in zip(self.image_ids, blob_keys):
+            if blob_key is None:
+                raise HTTPException(status_code=404, detail=f"Image {image_id} not found")
+
+        unique_keys = list(dict.fromkeys(blob_keys))
+        try:
+            loaded = await asyncio.gather(*(
+                asyncio.to_thread(load_input_image, blob_key)
+                for blob_key in unique_keys))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to load input images: {str(e)}")
+        self._images = dict(zip(unique_keys, loaded))
+
+    def base64_images(self):
+        if not self._images:
+            return []
+        return [self._images[blob_key]["base64"] for blob_key in self._blob_keys]
+
+    def sizes(self):
+        if not self._images:
+            return []
+        return [self._images[blob_key]["size"] for blob_key in self._blob_keys]
+
+
+def load_input_image(blob_key):
+    """
+    Fetch one input image and prepare what Bedrock requests need. Blocking.
+    """
+    image_data = fetch_image_bytes(blob_key)
+    return {
+        "base64": base64.b64encode(image_data).decode('utf-8'),
+        "size": get_image_size(image_data),
+    }
+
+
+async def generation_cache_key(kind, inputs, **fields):
+    """
+    Result cache key of a generation request. Input images are identified by
+    their blobs, so re-saving an image under the same ID changes the key.
+    """
+    blob_keys = await inputs.blob_keys() or None
+    return request_key(model=model_id, kind=kind, images=blob_keys, **fields)
+
+
+async def cached_result(results, cache_key):
+    """
+    Save the images of a cached result for this task.
+    Returns:
+        list: The saved paths, or None on a cache miss.
+    """
+    img_list = await asyncio.to_thread(result_cache.get, cache_key)
+    if img_list is None:
+        return None
+    logger.info(f"Task {results.task_id} answered from the generation cache")
+    await results.save(0, img_list)
+    return results.paths()
+
+
+TASK_JOBS = {
+    "generation": generate_image_logic,
+    "inpainting": inpainting_image_logic,
+}
 
 
 @app.get("/")
@@ -184,6 +469,24 @@ async def root():
     return {"message": "Hello World"}
 
 
+def parse_seed(seed):
+    """
+    Returns:
+        int: The seed of a generation request, or None if not given.
+    Raises:
+        ValueError: If it is not an integer Nova Canvas accepts.
+    """
+    if seed is None or seed == "":
+        return None
+    try:
+        value = int(seed)
+    except ValueError:
+        raise ValueError(f"seed must be an integer, got {seed!r}")
+    if not 0 <= value < SEED_RANGE:
+        raise ValueError(f"seed must be between 0 and {SEED_RANGE - 1}")
+    return value
+
+
 @app.post("/img/generate")
 async def generate_image(
         batch_count: int = Form(...),
@@ -193,7 +496,20 @@ async def generate_image(
         seed: Optional[str] = Form(None),
         similarityStrength: Optional[float] = Form(None),
         parameters: Optional[Dict] = Form(None),
+        projectId: Optional[str] = Form(None),
 ):
+    try:
+        seed = parse_seed(seed)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    if projectId:
+        error = await check_project_writable(projectId)
+        if error:
+            return error
+
+    # Only requests with an explicit seed are deterministic enough to cache
+    cacheable = seed is not None
     seed = random.randint(0, 214783647) if seed is None else seed
 
     height = parameters.get("height") if parameters else 1024
@@ -207,20 +523,19 @@ async def generate_image(
 
     logger.info("text: %s", text)
 
-    task_id = str(uuid.uuid4())  # Generate a unique task ID
-
-    task = {"id": task_id, "status": "queued", "result": None, "error": None}
-    logger.info(f"Received image generation task: {task_id}, {task}")
-    with image_tasks_lock:
-        image_tasks[task_id] = task
-
-    # 啟動線程執行圖片生成任務
-    threading.Thread(target=run_image_generation_task,
-                     args=(task_id, text, imgs, batch_count, height, width,
-                           cfg_scale, seed, similarityStrength),
-                     daemon=True).start()
-
-    return {"id": task_id}
+    # 交給生成佇列執行圖片生成任務
+    return await submit_task("generation", {
+        "text": text,
+        "imgs": imgs,
+        "batch_count": batch_count,
+        "height": height,
+        "width": width,
+        "cfg_scale": cfg_scale,
+        "seed": seed,
+        "similarityStrength": similarityStrength,
+        "cacheable": cacheable,
+        "projectId": projectId,
+    })
 
 
 @app.post("/img/inpainting")
@@ -234,7 +549,19 @@ async def inpainting_image(
                     cfg_scale: float = Form(...),
                     seed: Optional[str] = Form(None),
                     parameters: Optional[Dict] = Form(None),
+                    projectId: Optional[str] = Form(None),
                 ):
+    try:
+        seed = parse_seed(seed)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    if projectId:
+        error = await check_project_writable(projectId)
+        if error:
+            return error
+
+    cacheable = seed is not None
     seed = random.randint(0, 214783647) if seed is None else seed
 
     height = parameters.get("height") if parameters else 1024
@@ -254,45 +581,52 @@ async def inpainting_image(
 
     # logger.info("mask_image_data: %s", mask_image_data)
 
-    task_id = str(uuid.uuid4())
-
-    task = {"id": task_id, "status": "queued", "result": None, "error": None}
-    logger.info(f"Received image inpainting task: {task_id}, {task}")
-    with image_tasks_lock:
-        image_tasks[task_id] = task
-
-    threading.Thread(target=run_image_inpainting_task,
-             args=(task_id, batch_count, text, imgs, mask_prompt,
-               mask_image_data, negative_prompt, height, width,
-               cfg_scale, seed),
-             daemon=True).start()
-
-    return {"id": task_id}
+    return await submit_task("inpainting", {
+        "batch_count": batch_count,
+        "text": text,
+        "imgs": imgs,
+        "mask_prompt": mask_prompt,
+        "mask_image": mask_image_data,
+        "negative_prompt": negative_prompt,
+        "height": height,
+        "width": width,
+        "cfg_scale": cfg_scale,
+        "seed": seed,
+        "cacheable": cacheable,
+        "projectId": projectId,
+    })
 
 @app.post("/project/create")
 async def create_project(name: str = Form(...),
                         description: Optional[str] = Form(None),
                         templateId: Optional[str] = Form(None)):
     try:
-        cursor = conn.cursor()
+        def run_query(conn):
+            cursor = conn.cursor()
 
-        # Generate unique project ID
-        project_id = str(uuid.uuid4())
-        current_time = datetime.now()
+            # Generate unique project ID
+            project_id = str(uuid.uuid4())
+            current_time = datetime.now()
 
-        # Insert project into database
-        insert_query = """
-        INSERT INTO projects (id, name, description, template_id, created_at, modified_at)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        values = (project_id, name, description, templateId, current_time, current_time)
+            # Insert project into database
+            insert_query = """
+            INSERT INTO projects (id, name, description, template_id, created_at, modified_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """
+            values = (project_id, name, description, templateId, current_time, current_time)
 
-        cursor.execute(insert_query, values)
-        conn.commit()
+            cursor.execute(insert_query, values)
 
-        cursor.close()
+            # Start from the template's images; they share its blobs
+            if templateId:
+                copy_project_images(conn, templateId, project_id)
+            conn.commit()
+
+            cursor.close()
 
-        return {"id": project_id}
+            return {"id": project_id}
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
         return {"error": f"Database error: {str(err)}"}, 500
@@ -303,72 +637,62 @@ async def create_project(name: str = Form(...),
 @app.post("/project/delete")
 async def delete_project(id: str = Form(...)):
     try:
-        cursor = conn.cursor(dictionary=True)
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
         
-        # First verify the project exists and check if it's readonly
-        verify_query = "SELECT readonly FROM projects WHERE id = %s"
-        cursor.execute(verify_query, (id,))
-        project = cursor.fetchone()
+            # First verify the project exists and check if it's readonly
+            verify_query = "SELECT readonly FROM projects WHERE id = %s"
+            cursor.execute(verify_query, (id,))
+            project = cursor.fetchone()
         
-        if not project:
-            return JSONResponse(
-                status_code=404,
-                content={"error": "Project not found"}
-            )
-            
-        if project["readonly"]:
-            return JSONResponse(
-                status_code=403,
-                content={"error": "Cannot delete readonly project/template"}
-            )
+            if not project:
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": "Project not found"}
+                )
             
-        # Get all images associated with this project
-        image_query = "SELECT id FROM images WHERE project_id = %s"
-        cursor.execute(image_query, (id,))
-        project_images = cursor.fetchall()
-        
-        # Delete images from S3 and database
-        for image in project_images:
-            try:
-                # Delete from S3
-                s3_key = f"images/{image['id']}"
-                s3_client.delete_object(
-                    Bucket="scottish-leader",
-                    Key=s3_key
+            if project["readonly"]:
+                return JSONResponse(
+                    status_code=403,
+                    content={"error": "Cannot delete readonly project/template"}
                 )
-            except Exception as e:
-                logger.error(f"Failed to delete image {image['id']} from S3: {str(e)}")
-                # Continue with other deletions even if S3 delete fails
+            
+            # Release the blobs used by the project's images
+            garbage = release_refs(conn, "project_id = %s", (id,))
         
-        # Delete all project images from database
-        delete_images_query = "DELETE FROM images WHERE project_id = %s"
-        cursor.execute(delete_images_query, (id,))
+            # Delete all project images from database
+            delete_images_query = "DELETE FROM images WHERE project_id = %s"
+            cursor.execute(delete_images_query, (id,))
         
-        # Delete project tags
-        delete_tags_query = "DELETE FROM project_tags WHERE project_id = %s"
-        cursor.execute(delete_tags_query, (id,))
+            # Delete project tags
+            delete_tags_query = "DELETE FROM project_tags WHERE project_id = %s"
+            cursor.execute(delete_tags_query, (id,))
         
-        # Delete project record
-        delete_project_query = "DELETE FROM projects WHERE id = %s"
-        cursor.execute(delete_project_query, (id,))
+            # Delete project record
+            delete_project_query = "DELETE FROM projects WHERE id = %s"
+            cursor.execute(delete_project_query, (id,))
         
-        conn.commit()
-        cursor.close()
+            conn.commit()
+            cursor.close()
+
+            # Blobs still shared with other projects or templates are kept;
+            # the rest are removed from S3 in the background
+            forget_blobs(garbage)
         
-        return {
-            "message": "Project and associated images deleted successfully",
-            "id": id
-        }
+            return {
+                "message": "Project and associated images deleted successfully",
+                "id": id
+            }
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
-        conn.rollback()
         logger.error(f"Database error while deleting project: {str(err)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Database error: {str(err)}"}
         )
     except Exception as e:
-        conn.rollback()
         logger.error(f"Server error while deleting project: {str(e)}")
         return JSONResponse(
             status_code=500,
@@ -378,53 +702,46 @@ async def delete_project(id: str = Form(...)):
 @app.post("/img/delete")
 async def delete_image(id: str = Form(...)):
     try:
-        cursor = conn.cursor(dictionary=True)
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
         
-        # First verify the image exists and get its metadata
-        select_query = "SELECT project_id FROM images WHERE id = %s"
-        cursor.execute(select_query, (id,))
-        image = cursor.fetchone()
+            # First verify the image exists and get its metadata
+            select_query = "SELECT project_id FROM images WHERE id = %s"
+            cursor.execute(select_query, (id,))
+            image = cursor.fetchone()
         
-        if not image:
-            return JSONResponse(
-                status_code=404,
-                content={"error": "Image not found"}
-            )
+            if not image:
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": "Image not found"}
+                )
             
-        # Delete from S3
-        try:
-            s3_key = f"images/{id}"
-            s3_client.delete_object(
-                Bucket="scottish-leader",
-                Key=s3_key
-            )
-        except Exception as e:
-            logger.error(f"S3 deletion failed: {str(e)}")
-            return JSONResponse(
-                status_code=500,
-                content={"error": f"Failed to delete image from storage: {str(e)}"}
-            )
+            # Delete from database, releasing the image's blob
+            garbage = release_refs(conn, "id = %s", (id,))
+            delete_query = "DELETE FROM images WHERE id = %s"
+            cursor.execute(delete_query, (id,))
+            cursor.execute("UPDATE projects SET modified_at = %s WHERE id = %s",
+                           (datetime.now(), image["project_id"]))
+            conn.commit()
+            cursor.close()
 
-        # Delete from database
-        delete_query = "DELETE FROM images WHERE id = %s"
-        cursor.execute(delete_query, (id,))
-        conn.commit()
-        cursor.close()
+            # The bytes go only if no other image shares them
+            forget_blobs(garbage)
         
-        return {
-            "message": "Image deleted successfully",
-            "id": id
-        }
+            return {
+                "message": "Image deleted successfully",
+                "id": id
+            }
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
-        conn.rollback()
         logger.error(f"Database error while deleting image: {str(err)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Database error: {str(err)}"}
         )
     except Exception as e:
-        conn.rollback()
         logger.error(f"Server error while deleting image: {str(e)}")
         return JSONResponse(
             status_code=500,
@@ -441,158 +758,349 @@ async def save_image(
         parameters: Optional[Dict] = Form(None),
 ):
     try:
-        cursor = conn.cursor()
-        
+        # Read image data
+        image_data = await file.read()
+
         # Generate image ID if not provided
         image_id = id or str(uuid.uuid4())
-        
+
         # Convert parameters to JSON if provided
         parameters_json = json.dumps(parameters) if parameters else None
-        
-        # Read image data
-        image_data = await file.read()
+
         # Log image details
         logger.info(f"Saving image {image_id} for project {projectId}. File type: {file.content_type}, Size: {len(image_data)} bytes")
-        # Upload to S3
+        # Upload to S3 as a new blob, before taking a database connection.
+        # Replacing an image never writes over its old blob, which templates
+        # or copies may still share.
         try:
-            s3_key = f"images/{image_id}"
-            s3_client.put_object(
+            blob_key = new_blob_key()
+            await asyncio.to_thread(
+                s3_client.put_object,
                 Bucket="scottish-leader",
-                Key=s3_key,
+                Key=blob_key,
                 Body=image_data,
                 ContentType=file.content_type
             )
         except Exception as e:
             logger.error(f"S3 upload failed: {str(e)}")
             return {"error": f"Failed to upload image: {str(e)}"}, 500
-        
-        # Insert image metadata into database
-        insert_query = """
-        INSERT INTO images (id, project_id, type, seed, prompt, parameters)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            type = VALUES(type),
-            seed = VALUES(seed),
-            prompt = VALUES(prompt),
-            parameters = VALUES(parameters)
-        """
-        values = (image_id, projectId, file.content_type, seed, prompt, parameters_json)
-        
-        cursor.execute(insert_query, values)
-        conn.commit()
-        cursor.close()
-        
+
+        def run_query(conn):
+            cursor = conn.cursor()
+            try:
+                # Drop the reference held by the image being replaced, if any
+                garbage = release_refs(conn, "id = %s", (image_id,))
+                add_blob(conn, blob_key)
+
+                # Insert image metadata into database
+                insert_query = """
+                INSERT INTO images (id, project_id, type, seed, prompt, parameters, blob_key)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    type = VALUES(type),
+                    seed = VALUES(seed),
+                    prompt = VALUES(prompt),
+                    parameters = VALUES(parameters),
+                    blob_key = VALUES(blob_key)
+                """
+                values = (image_id, projectId, file.content_type, seed, prompt, parameters_json, blob_key)
+
+                cursor.execute(insert_query, values)
+                # Images are part of the project, so they bump its modified_at (ETag)
+                cursor.execute("UPDATE projects SET modified_at = %s WHERE id = %s",
+                               (datetime.now(), projectId))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+            return garbage
+
+        try:
+            garbage = await db_pool.run(run_query)
+        except Exception:
+            # Nothing refers to the new blob yet
+            try:
+                await asyncio.to_thread(s3_client.delete_object,
+                                        Bucket="scottish-leader", Key=blob_key)
+            except Exception as e:
+                logger.error(f"Failed to delete orphaned blob {blob_key}: {str(e)}")
+            raise
+
+        forget_blobs(garbage)
+
         return {
             "id": image_id,
         }
 
     except mysql.connector.Error as err:
-        conn.rollback()
         return {"error": f"Database error: {str(err)}"}, 500
     except Exception as e:
-        conn.rollback()
         return {"error": f"Server error: {str(e)}"}, 500
 
-@app.post("/template/create")
-async def create_template(
-    projectId: str = Form(...),
-    name: Optional[str] = Form(None),
-    description: Optional[str] = Form(None)
+@app.post("/img/promote")
+async def promote_images(
+        projectId: str = Form(...),
+        paths: List[str] = Form(...),
+        seed: Optional[str] = Form(None),
+        prompt: Optional[str] = Form(None),
+        parameters: Optional[Dict] = Form(None),
 ):
+    """
+    Save generated results (paths returned by /img/result) into a project
+    without the client downloading and re-uploading them.
+    """
+    files = []
+    for path in paths:
+        file_path = generated_image_path(path)
+        if file_path is None:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Not a generated image: {path}"}
+            )
+        files.append(file_path)
+
     try:
-        cursor = conn.cursor(dictionary=True)
-        template_id = str(uuid.uuid4())
-        current_time = datetime.now()
+        error = await check_project_writable(projectId)
+        if error:
+            return error
 
-        # First verify the source project exists and get its details
-        cursor.execute("SELECT name, description FROM projects WHERE id = %s", (projectId,))
-        source_project = cursor.fetchone()
-        if not source_project:
+        def read_files():
+            images = []
+            for file_path in files:
+                with open(file_path, "rb") as f:
+                    images.append(f.read())
+            return images
+
+        try:
+            images = await asyncio.to_thread(read_files)
+        except FileNotFoundError as e:
             return JSONResponse(
                 status_code=404,
-                content={"error": "Source project not found"}
+                content={"error": f"Generated image not found: {os.path.basename(e.filename)}"}
             )
 
-        # Use provided name/description or generate from source project
-        template_name = name or f"Template - {source_project['name']}"
-        template_description = description or source_project['description']
+        image_ids = await persist_images(projectId, images, seed=seed,
+                                         prompt=prompt, parameters=parameters)
+        return {"ids": image_ids}
 
-        # Get source project images
-        cursor.execute("SELECT id, type FROM images WHERE project_id = %s", (projectId,))
-        source_images = cursor.fetchall()
+    except mysql.connector.Error as err:
+        logger.error(f"Database error while promoting images: {str(err)}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Database error: {str(err)}"}
+        )
+    except Exception as e:
+        logger.error(f"Server error while promoting images: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Server error: {str(e)}"}
+        )
 
-        # Copy project metadata with readonly flag
-        copy_project_query = """
-        INSERT INTO projects (id, name, description, created_at, modified_at, readonly)
-        VALUES (%s, %s, %s, %s, %s, TRUE)
-        """
-        cursor.execute(copy_project_query, 
-                      (template_id, template_name, template_description, current_time, current_time))
 
-        # Copy project tags
-        copy_tags_query = """
-        INSERT INTO project_tags (project_id, tag)
-        SELECT %s, tag FROM project_tags WHERE project_id = %s
-        """
-        cursor.execute(copy_tags_query, (template_id, projectId))
+def generated_image_path(path):
+    """
+    Map a /generated_images/... URL to its file, or None if it points
+    anywhere else.
+    """
+    _, found, name = path.rpartition("/generated_images/")
+    if not found or not name or name != os.path.basename(name) or name.startswith("."):
+        return None
+    return os.path.join("generated_images", name)
+
+
+async def check_project_writable(project_id):
+    """
+    Returns:
+        JSONResponse: A 404/403 response if images cannot be saved into the
+            project, otherwise None.
+    """
+    def run_query(conn):
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT readonly FROM projects WHERE id = %s", (project_id,))
+        project = cursor.fetchone()
+        cursor.close()
+        return project
 
-        # Copy images and their data
-        for source_image in source_images:
-            # Generate new image ID
-            new_image_id = str(uuid.uuid4())
-            
-            try:
-                # Copy image data from S3
-                source_key = f"images/{source_image['id']}"
-                target_key = f"images/{new_image_id}"
-                
-                # Get source image from S3
-                s3_response = s3_client.get_object(
-                    Bucket="scottish-leader",
-                    Key=source_key
-                )
-                image_data = s3_response['Body'].read()
-                
-                # Upload to new location in S3
-                s3_client.put_object(
-                    Bucket="scottish-leader",
-                    Key=target_key,
-                    Body=image_data,
-                    ContentType=source_image['type']
+    project = await db_pool.run(run_query)
+    if not project:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Project not found"}
+        )
+    if project["readonly"]:
+        return JSONResponse(
+            status_code=403,
+            content={"error": "Cannot save images into a template"}
+        )
+    return None
+
+
+async def persist_images(project_id, images, seed=None, prompt=None,
+                         parameters=None, image_ids=None):
+    """
+    Upload images as new blobs and add them to a project in one transaction.
+    Given ``image_ids``, images whose ID already exists are skipped, which
+    makes repeating the same save harmless. Uploads that end up unreferenced
+    are deleted again.
+    Returns:
+        list: The image IDs, in order.
+    """
+    image_ids = image_ids or [str(uuid.uuid4()) for _ in images]
+
+    def find_existing(conn):
+        cursor = conn.cursor()
+        placeholders = ", ".join(["%s"] * len(image_ids))
+        cursor.execute(
+            f"SELECT id FROM images WHERE id IN ({placeholders})",
+            tuple(image_ids))
+        existing = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return existing
+
+    existing = await db_pool.run(find_existing)
+    pending = [(image_id, image) for image_id, image in zip(image_ids, images)
+               if image_id not in existing]
+    if not pending:
+        return image_ids
+
+    blob_keys = {image_id: new_blob_key() for image_id, _ in pending}
+    content_types = {image_id: media_type(image) for image_id, image in pending}
+    await asyncio.gather(*(
+        asyncio.to_thread(s3_client.put_object,
+                          Bucket="scottish-leader",
+                          Key=blob_keys[image_id],
+                          Body=image,
+                          ContentType=content_types[image_id])
+        for image_id, image in pending))
+
+    parameters_json = json.dumps(parameters) if parameters else None
+
+    def run_query(conn):
+        cursor = conn.cursor()
+        unused = []
+        try:
+            for image_id, _ in pending:
+                # Skips IDs saved concurrently since the check above
+                cursor.execute(
+                    """
+                    INSERT INTO images (id, project_id, type, seed, prompt, parameters, blob_key)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE id = id
+                    """,
+                    (image_id, project_id, content_types[image_id], seed,
+                     prompt, parameters_json, blob_keys[image_id]))
+                # rowcount is unreliable here (FOUND_ROWS), so see whose
+                # blob the row ended up with
+                cursor.execute("SELECT blob_key FROM images WHERE id = %s",
+                               (image_id,))
+                if cursor.fetchone()[0] == blob_keys[image_id]:
+                    add_blob(conn, blob_keys[image_id])
+                else:
+                    unused.append(blob_keys[image_id])
+            # Images are part of the project, so they bump its modified_at (ETag)
+            cursor.execute("UPDATE projects SET modified_at = %s WHERE id = %s",
+                           (datetime.now(), project_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return unused
+
+    try:
+        unused = await db_pool.run(run_query)
+    except Exception:
+        await delete_unreferenced(list(blob_keys.values()))
+        raise
+    await delete_unreferenced(unused)
+
+    logger.info(f"Saved {len(pending)} images into project {project_id}")
+    return image_ids
+
+
+async def delete_unreferenced(blob_keys):
+    """
+    Delete uploads that no image row refers to. Failures are only logged;
+    the objects are then left behind in S3.
+    """
+    if not blob_keys:
+        return
+    try:
+        await asyncio.to_thread(
+            s3_client.delete_objects,
+            Bucket="scottish-leader",
+            Delete={"Objects": [{"Key": blob_key} for blob_key in blob_keys],
+                    "Quiet": True})
+    except Exception as e:
+        logger.error(f"Failed to delete unreferenced blobs {blob_keys}: {str(e)}")
+
+
+@app.post("/template/create")
+async def create_template(
+    projectId: str = Form(...),
+    name: Optional[str] = Form(None),
+    description: Optional[str] = Form(None)
+):
+    try:
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
+            template_id = str(uuid.uuid4())
+            current_time = datetime.now()
+
+            # First verify the source project exists and get its details
+            cursor.execute("SELECT name, description FROM projects WHERE id = %s", (projectId,))
+            source_project = cursor.fetchone()
+            if not source_project:
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": "Source project not found"}
                 )
-                
-                # Insert new image record
-                insert_image_query = """
-                INSERT INTO images (id, project_id, type, seed, prompt, parameters)
-                SELECT %s, %s, type, seed, prompt, parameters 
-                FROM images 
-                WHERE id = %s
-                """
-                cursor.execute(insert_image_query, (new_image_id, template_id, source_image['id']))
-                
-            except Exception as e:
-                logger.error(f"Failed to copy image {source_image['id']}: {str(e)}")
-                raise
 
-        conn.commit()
-        cursor.close()
+            # Use provided name/description or generate from source project
+            template_name = name or f"Template - {source_project['name']}"
+            template_description = description or source_project['description']
+
+            # Copy project metadata with readonly flag
+            copy_project_query = """
+            INSERT INTO projects (id, name, description, created_at, modified_at, readonly)
+            VALUES (%s, %s, %s, %s, %s, TRUE)
+            """
+            cursor.execute(copy_project_query, 
+                          (template_id, template_name, template_description, current_time, current_time))
+
+            # Copy project tags
+            copy_tags_query = """
+            INSERT INTO project_tags (project_id, tag)
+            SELECT %s, tag FROM project_tags WHERE project_id = %s
+            """
+            cursor.execute(copy_tags_query, (template_id, projectId))
+
+            # Copy image records; the template shares the project's blobs,
+            # so no image data is copied
+            copy_project_images(conn, projectId, template_id)
+
+            conn.commit()
+            cursor.close()
 
-        return {
-            "templateId": template_id,
-            "name": template_name,
-            "sourceProjectId": projectId,
-            "created": current_time.isoformat()
-        }
+            return {
+                "templateId": template_id,
+                "name": template_name,
+                "sourceProjectId": projectId,
+                "created": current_time.isoformat()
+            }
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
-        conn.rollback()
         logger.error(f"Database error while creating template: {str(err)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Database error: {str(err)}"}
         )
     except Exception as e:
-        conn.rollback()
         logger.error(f"Server error while creating template: {str(e)}")
         return JSONResponse(
             status_code=500,
@@ -602,83 +1110,71 @@ async def create_template(
 @app.post("/template/delete")
 async def delete_template(id: str = Form(...)):
     try:
-        cursor = conn.cursor(dictionary=True)
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
         
-        # First verify the template exists and check if it's a readonly project
-        verify_query = "SELECT readonly FROM projects WHERE id = %s"
-        cursor.execute(verify_query, (id,))
-        template = cursor.fetchone()
+            # First verify the template exists and check if it's a readonly project
+            verify_query = "SELECT readonly FROM projects WHERE id = %s"
+            cursor.execute(verify_query, (id,))
+            template = cursor.fetchone()
         
-        if not template:
-            return JSONResponse(
-                status_code=404,
-                content={"error": "Template not found"}
-            )
+            if not template:
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": "Template not found"}
+                )
             
-        if not template["readonly"]:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "Specified ID is not a template"}
-            )
-        
-        # Check if any projects are using this template
-        check_usage_query = "SELECT COUNT(*) as count FROM projects WHERE template_id = %s"
-        cursor.execute(check_usage_query, (id,))
-        usage = cursor.fetchone()
+            if not template["readonly"]:
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": "Specified ID is not a template"}
+                )
         
-        if usage["count"] > 0:
-            return JSONResponse(
-                status_code=409,
-                content={"error": "Template is in use by existing projects"}
-            )
-            
-        # Get all images associated with this template
-        image_query = "SELECT id FROM images WHERE project_id = %s"
-        cursor.execute(image_query, (id,))
-        template_images = cursor.fetchall()
+            # Check if any projects are using this template
+            check_usage_query = "SELECT COUNT(*) as count FROM projects WHERE template_id = %s"
+            cursor.execute(check_usage_query, (id,))
+            usage = cursor.fetchone()
         
-        # Delete images from S3 and database
-        for image in template_images:
-            try:
-                # Delete from S3
-                s3_key = f"images/{image['id']}"
-                s3_client.delete_object(
-                    Bucket="scottish-leader",
-                    Key=s3_key
+            if usage["count"] > 0:
+                return JSONResponse(
+                    status_code=409,
+                    content={"error": "Template is in use by existing projects"}
                 )
-            except Exception as e:
-                logger.error(f"Failed to delete image {image['id']} from S3: {str(e)}")
-                # Continue with other deletions even if S3 delete fails
+            
+            # Release the blobs used by the template's images
+            garbage = release_refs(conn, "project_id = %s", (id,))
         
-        # Delete all template images from database
-        delete_images_query = "DELETE FROM images WHERE project_id = %s"
-        cursor.execute(delete_images_query, (id,))
+            # Delete all template images from database
+            delete_images_query = "DELETE FROM images WHERE project_id = %s"
+            cursor.execute(delete_images_query, (id,))
         
-        # Delete template tags
-        delete_tags_query = "DELETE FROM project_tags WHERE project_id = %s"
-        cursor.execute(delete_tags_query, (id,))
+            # Delete template tags
+            delete_tags_query = "DELETE FROM project_tags WHERE project_id = %s"
+            cursor.execute(delete_tags_query, (id,))
         
-        # Delete template record
-        delete_template_query = "DELETE FROM projects WHERE id = %s"
-        cursor.execute(delete_template_query, (id,))
+            # Delete template record
+            delete_template_query = "DELETE FROM projects WHERE id = %s"
+            cursor.execute(delete_template_query, (id,))
         
-        conn.commit()
-        cursor.close()
+            conn.commit()
+            cursor.close()
+
+            forget_blobs(garbage)
         
-        return {
-            "message": "Template and associated images deleted successfully",
-            "id": id
-        }
+            return {
+                "message": "Template and associated images deleted successfully",
+                "id": id
+            }
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
-        conn.rollback()
         logger.error(f"Database error while deleting template: {str(err)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Database error: {str(err)}"}
         )
     except Exception as e:
-        conn.rollback()
         logger.error(f"Server error while deleting template: {str(e)}")
         return JSONResponse(
             status_code=500,
@@ -687,81 +1183,159 @@ async def delete_template(id: str = Form(...)):
     
 @app.post("/txt/optimize")
 async def optimize_text(text: str = Form(...)):
-    return {"text": enhance_pc_case_prompt(text)}  # Placeholder
+    return {"text": await enhance_pc_case_prompt_async(text)}
+
+
+@app.post("/txt/optimize/stream")
+async def optimize_text_stream(text: str = Form(...)):
+    """
+    Same as /txt/optimize, streamed as Server-Sent Events: "delta" events
+    while the model writes, then "done" with the whole text, or "error".
+    """
+    return StreamingResponse(
+        optimize_event_stream(text),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+
+async def optimize_event_stream(text):
+    result = ""
+    try:
+        async for delta in stream_pc_case_prompt_async(text):
+            result += delta
+            yield sse_event("delta", {"text": delta})
+    except Exception as e:
+        logger.error(f"Prompt enhancement failed: {str(e)}")
+        yield sse_event("error", {"error": str(e)})
+        return
+    yield sse_event("done", {"text": result})
 
 
 # GET endpoints
 
 @app.get("/project/{id}")
-async def get_project(id: str):
+async def get_project(id: str,
+                      if_none_match: Optional[str] = Header(None),
+                      if_modified_since: Optional[str] = Header(None),
+                      imageLimit: Optional[int] = Query(None),
+                      imageCursor: Optional[str] = Query(None)):
+    # Images are paged only when asked for, so existing clients still get
+    # every image in one response
+    paginate = imageLimit is not None or imageCursor is not None
     try:
-        cursor = conn.cursor(dictionary=True)
+        image_limit = page_size(imageLimit, PROJECT_IMAGE_PAGE_SIZE) if paginate else None
+        after_image_id = None
+        if imageCursor:
+            after_image_id, = decode_cursor(imageCursor, 1)
+    except CursorError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
+
+            # Answer conditional requests from modified_at alone
+            cursor.execute("SELECT modified_at FROM projects WHERE id = %s", (id,))
+            row = cursor.fetchone()
+            if row:
+                etag = row_etag(id, row["modified_at"].isoformat(),
+                                image_limit, imageCursor)
+                if is_not_modified(if_none_match, if_modified_since, etag,
+                                   row["modified_at"]):
+                    cursor.close()
+                    return not_modified_response(etag, row["modified_at"])
         
-        # Get project details including template info if it exists
-        project_query = """
-        SELECT 
-            p.id,
-            p.name,
-            p.description,
-            p.template_id,
-            p.created_at,
-            p.modified_at,
-            p.readonly,
-            GROUP_CONCAT(DISTINCT pt.tag) as tags,
-            GROUP_CONCAT(DISTINCT i.id) as image_ids
-        FROM projects p
-        LEFT JOIN project_tags pt ON p.id = pt.project_id
-        LEFT JOIN images i ON p.id = i.project_id
-        WHERE p.id = %s
-        GROUP BY p.id, p.name, p.description, p.template_id, p.created_at, p.modified_at, p.readonly
-        """
+            # Get project details including template info if it exists
+            project_query = """
+            SELECT 
+                p.id,
+                p.name,
+                p.description,
+                p.template_id,
+                p.created_at,
+                p.modified_at,
+                p.readonly,
+                GROUP_CONCAT(DISTINCT pt.tag) as tags,
+                (SELECT COUNT(*) FROM images i WHERE i.project_id = p.id) as image_count
+            FROM projects p
+            LEFT JOIN project_tags pt ON p.id = pt.project_id
+            WHERE p.id = %s
+            GROUP BY p.id, p.name, p.description, p.template_id, p.created_at, p.modified_at, p.readonly
+            """
         
-        cursor.execute(project_query, (id,))
-        project = cursor.fetchone()
+            cursor.execute(project_query, (id,))
+            project = cursor.fetchone()
         
-        if not project:
-            cursor.close()
-            return JSONResponse(
-                status_code=404,
-                content={"error": "Project not found"}
-            )
+            if not project:
+                cursor.close()
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": "Project not found"}
+                )
             
-        # Get associated images with their metadata
-        images_query = """
-        SELECT id, type, seed, prompt, parameters
-        FROM images 
-        WHERE project_id = %s
-        """
-        cursor.execute(images_query, (id,))
-        images = cursor.fetchall()
+            # Get the associated images (or one page of them) with their metadata
+            images_query = """
+            SELECT id, type, seed, prompt, parameters
+            FROM images 
+            WHERE project_id = %s AND (%s IS NULL OR id > %s)
+            ORDER BY id
+            """
+            params = [id, after_image_id, after_image_id]
+            if paginate:
+                images_query += " LIMIT %s"
+                params.append(image_limit + 1)
+            cursor.execute(images_query, tuple(params))
+            images = cursor.fetchall()
         
-        cursor.close()
+            cursor.close()
 
-        # Process images data
-        processed_images = []
-        for img in images:
-            processed_images.append({
-                "id": img["id"],
-                "type": img["type"],
-                "seed": img["seed"],
-                "prompt": img["prompt"],
-                "parameters": json.loads(img["parameters"]) if img["parameters"] else None
-            })
-
-        # Prepare response
-        response = {
-            "id": project["id"],
-            "name": project["name"],
-            "description": project["description"],
-            "templateId": project["template_id"],
-            "readonly": project["readonly"],
-            "tags": project["tags"].split(",") if project["tags"] else [],
-            "images": processed_images,
-            "created": project["created_at"].isoformat(),
-            "modified": project["modified_at"].isoformat()
-        }
+            next_image_cursor = None
+            if paginate and len(images) > image_limit:
+                images = images[:image_limit]
+                next_image_cursor = encode_cursor(images[-1]["id"])
+
+            # Process images data
+            processed_images = []
+            for img in images:
+                processed_images.append({
+                    "id": img["id"],
+                    "type": img["type"],
+                    "seed": img["seed"],
+                    "prompt": img["prompt"],
+                    "parameters": json.loads(img["parameters"]) if img["parameters"] else None
+                })
+
+            # Prepare response
+            response = {
+                "id": project["id"],
+                "name": project["name"],
+                "description": project["description"],
+                "templateId": project["template_id"],
+                "readonly": project["readonly"],
+                "tags": project["tags"].split(",") if project["tags"] else [],
+                "images": processed_images,
+                "imageCount": project["image_count"],
+                "created": project["created_at"].isoformat(),
+                "modified": project["modified_at"].isoformat()
+            }
+            if paginate:
+                response["nextImageCursor"] = next_image_cursor
         
-        return response
+            return JSONResponse(
+                content=jsonable_encoder(response),
+                headers={
+                    "ETag": row_etag(id, project["modified_at"].isoformat(),
+                                     image_limit, imageCursor),
+                    "Last-Modified": http_date(project["modified_at"]),
+                    "Cache-Control": "no-cache"
+                }
+            )
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
         logger.error(f"Database error while fetching project: {str(err)}")
@@ -777,71 +1351,114 @@ async def get_project(id: str):
         )
     
 @app.get("/templates")
-async def get_all_templates():
-    try:
-        cursor = conn.cursor(dictionary=True)
-        
-        # Simplified query to get only template IDs
-        query = """
-        SELECT id
-        FROM projects
-        WHERE readonly = TRUE
-        ORDER BY modified_at DESC
-        """
-        
-        cursor.execute(query)
-        templates = cursor.fetchall()
-        cursor.close()
-        
-        # Extract just the IDs
-        template_ids = [template["id"] for template in templates]
-        
-        return {"templates": template_ids}
-
-    except mysql.connector.Error as err:
-        logger.error(f"Database error while fetching templates: {str(err)}")
-        return JSONResponse(
-            status_code=500,
-            content={"error": f"Database error: {str(err)}"}
-        )
-    except Exception as e:
-        logger.error(f"Server error while fetching templates: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={"error": f"Server error: {str(e)}"}
-        )
+async def get_all_templates(expand: bool = Query(False),
+                            limit: Optional[int] = Query(None),
+                            cursor: Optional[str] = Query(None)):
+    return await list_projects(True, "templates", expand, limit, cursor)
 
 
 @app.get("/projects")
-async def get_all_projects():
+async def get_all_projects(expand: bool = Query(False),
+                           limit: Optional[int] = Query(None),
+                           cursor: Optional[str] = Query(None)):
+    return await list_projects(False, "projects", expand, limit, cursor)
+
+
+async def list_projects(readonly, key, expand, limit, page_cursor):
+    """
+    List projects (or templates), newest first.
+
+    Without ``expand``, ``limit`` or ``cursor`` every ID is returned, as
+    before. Otherwise one page is returned along with ``nextCursor``, a
+    keyset cursor on (modified_at, id). ``expand`` adds the fields a project
+    card needs, all gathered in the same query.
+    """
+    paginate = expand or limit is not None or page_cursor is not None
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        # Simplified query to get only project IDs for non-templates
-        query = """
-        SELECT id
-        FROM projects
-        WHERE readonly = FALSE
-        ORDER BY modified_at DESC
-        """
-        
-        cursor.execute(query)
-        projects = cursor.fetchall()
-        cursor.close()
-        
-        # Extract just the IDs
-        project_ids = [project["id"] for project in projects]
-        
-        return {"projects": project_ids}
+        size = page_size(limit)
+        after = None
+        if page_cursor:
+            modified_at, after_id = decode_cursor(page_cursor, 2)
+            after = (datetime.fromisoformat(modified_at), after_id)
+    except (CursorError, TypeError, ValueError):
+        return JSONResponse(status_code=400, content={"error": "Invalid cursor"})
+
+    try:
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
+
+            if expand:
+                columns = """
+                p.id, p.name, p.description, p.template_id, p.readonly,
+                p.created_at, p.modified_at,
+                (SELECT GROUP_CONCAT(pt.tag) FROM project_tags pt
+                 WHERE pt.project_id = p.id) AS tags,
+                (SELECT COUNT(*) FROM images i
+                 WHERE i.project_id = p.id) AS image_count
+                """
+            else:
+                columns = "p.id, p.modified_at"
+
+            query = f"""
+            SELECT {columns}
+            FROM projects p
+            WHERE p.readonly = %s
+            """
+            params = [readonly]
+            if after:
+                query += """
+                AND (p.modified_at < %s OR (p.modified_at = %s AND p.id < %s))
+                """
+                params += [after[0], after[0], after[1]]
+            query += "ORDER BY p.modified_at DESC, p.id DESC"
+            if paginate:
+                query += " LIMIT %s"
+                params.append(size + 1)
+
+            cursor.execute(query, tuple(params))
+            rows = cursor.fetchall()
+            cursor.close()
+
+            if not paginate:
+                # Extract just the IDs
+                return {key: [row["id"] for row in rows]}
+
+            next_cursor = None
+            if len(rows) > size:
+                rows = rows[:size]
+                last = rows[-1]
+                next_cursor = encode_cursor(last["modified_at"].isoformat(),
+                                            last["id"])
+
+            if expand:
+                items = [{
+                    "id": row["id"],
+                    "name": row["name"],
+                    "description": row["description"],
+                    "templateId": row["template_id"],
+                    "readonly": bool(row["readonly"]),
+                    "tags": row["tags"].split(",") if row["tags"] else [],
+                    "imageCount": row["image_count"],
+                    # Versioned so browsers refetch once the project changes
+                    "thumbnailUrl": f"/thumb/{row['id']}?v={int(row['modified_at'].timestamp())}",
+                    "created": row["created_at"].isoformat(),
+                    "modified": row["modified_at"].isoformat(),
+                } for row in rows]
+            else:
+                items = [row["id"] for row in rows]
+
+            return {key: items, "nextCursor": next_cursor}
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
-        logger.error(f"Database error while fetching projects: {str(err)}")
+        logger.error(f"Database error while fetching {key}: {str(err)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Database error: {str(err)}"}
         )
     except Exception as e:
-        logger.error(f"Server error while fetching projects: {str(e)}")
+        logger.error(f"Server error while fetching {key}: {str(e)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Server error: {str(e)}"}
@@ -849,41 +1466,125 @@ async def get_all_projects():
 
 
 @app.get("/template/{id}")
-async def get_template(id: str):
-    return await get_project(id)
+async def get_template(id: str,
+                       if_none_match: Optional[str] = Header(None),
+                       if_modified_since: Optional[str] = Header(None),
+                       imageLimit: Optional[int] = Query(None),
+                       imageCursor: Optional[str] = Query(None)):
+    return await get_project(id, if_none_match, if_modified_since,
+                             imageLimit, imageCursor)
 
 
 @app.get("/img/result/{taskId}")
 async def get_image_result(taskId: str):
-    # TODO: Implement image result retrieval logic
-    with image_tasks_lock:
-        task_status = image_tasks.get(taskId)
-        if not task_status:
-            task_status = "error"
-    task_status["urls"]=task_result.get(taskId)
+    task_status = await asyncio.to_thread(task_store.get, taskId)
+    if not task_status:
+        return JSONResponse(
+            status_code=404,
+            content={"id": taskId, "status": "error", "error": "Task not found"}
+        )
+    if task_status["status"] == "expired":
+        return JSONResponse(status_code=410, content=task_status)
     return task_status
+
+
+@app.get("/img/result/{taskId}/events")
+async def stream_image_result(taskId: str, request: Request):
+    """
+    Server-Sent Events stream of a task: a "status" event with the same body
+    as /img/result/{taskId} whenever the task changes, ending once it is
+    done, failed or expired.
+    """
+    if not await asyncio.to_thread(task_store.get, taskId):
+        return JSONResponse(
+            status_code=404,
+            content={"id": taskId, "status": "error", "error": "Task not found"}
+        )
+    return StreamingResponse(
+        task_event_stream(taskId, request),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Keep nginx from buffering the stream
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+
+async def task_event_stream(task_id, request):
+    loop = asyncio.get_running_loop()
+    with task_events.subscribe(task_id) as updates:
+        # Read the current state only after subscribing so no change is missed
+        task = await asyncio.to_thread(task_store.get, task_id)
+        sent = None
+        last_sent_at = loop.time()
+        while True:
+            if task is None:
+                return
+            if task != sent:
+                yield sse_event("status", task)
+                sent = task
+                last_sent_at = loop.time()
+            if task["status"] in FINISHED_STATUSES or task["status"] == "expired":
+                return
+            if await request.is_disconnected():
+                return
+            try:
+                task = await asyncio.wait_for(updates.get(),
+                                              TASK_EVENTS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                # The task may be running in another worker process
+                task = await asyncio.to_thread(task_store.get, task_id)
+                if task == sent and loop.time() - last_sent_at >= TASK_EVENTS_KEEPALIVE:
+                    yield ": keep-alive\n\n"
+                    last_sent_at = loop.time()
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "tasks": await asyncio.to_thread(task_store.stats),
+        "queue": task_queue.stats(),
+        "db": db_pool.stats(),
+        "imageCache": image_cache.stats(),
+        "generationCache": result_cache.stats(),
+        "promptCache": prompt_cache_stats(),
+        "bedrock": limiter_stats(),
+        "blobGc": blob_collector.stats(),
+        "taskEvents": task_events.stats(),
+    }
+
 @app.get("/thumb/{projectId}")
-async def get_thumb(projectId: str):
+async def get_thumb(projectId: str,
+                    if_none_match: Optional[str] = Header(None)):
     try:
-        cursor = conn.cursor(dictionary=True)
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
         
-        # Get first image ID from project
-        query = """
-        SELECT id 
-        FROM images 
-        WHERE project_id = %s 
-        ORDER BY id ASC 
-        LIMIT 1
-        """
+            # Get first image ID from project
+            query = """
+            SELECT id, blob_key 
+            FROM images 
+            WHERE project_id = %s 
+            ORDER BY id ASC 
+            LIMIT 1
+            """
         
-        cursor.execute(query, (projectId,))
-        result = cursor.fetchone()
-        cursor.close()
+            cursor.execute(query, (projectId,))
+            result = cursor.fetchone()
+            cursor.close()
+            return result
+
+        result = await db_pool.run(run_query)
         
         if not result:
             # Return default thumbnail from static folder
             default_thumb_path = "static/default_thumb.webp"
             if os.path.exists(default_thumb_path):
+                stat = os.stat(default_thumb_path)
+                etag = row_etag(default_thumb_path, stat.st_mtime, stat.st_size)
+                if etag_matches(if_none_match, etag):
+                    return not_modified_response(etag, cache_control="max-age=3600")
                 with open(default_thumb_path, "rb") as f:
                     image_data = f.read()
                 return Response(
@@ -891,7 +1592,8 @@ async def get_thumb(projectId: str):
                     media_type="image/webp",
                     headers={
                         "Cache-Control": "max-age=3600",
-                        "Content-Disposition": "inline; filename=default_thumb.webp"
+                        "Content-Disposition": "inline; filename=default_thumb.webp",
+                        "ETag": etag
                     }
                 )
             else:
@@ -899,10 +1601,28 @@ async def get_thumb(projectId: str):
                     status_code=404,
                     content={"error": "No images found and default thumbnail missing"}
                 )
-            
-        # Reuse get_image_file to return the actual image
+        
+        # Serve the small rendition, generating it on first use
         image_id = result['id']
-        return await get_image_file(image_id)
+        key = thumb_key(result['blob_key'])
+        if IMAGE_DELIVERY == "redirect":
+            # Make sure the rendition exists before pointing the client at it
+            if image_cache.etag(key) is None:
+                await asyncio.to_thread(ensure_thumbnail, result['blob_key'])
+            return presigned_redirect(key, THUMB_MEDIA_TYPE)
+        etag = image_cache.etag(key)
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag, cache_control="max-age=3600")
+        thumb_data = await asyncio.to_thread(fetch_thumbnail_bytes, result['blob_key'])
+        return Response(
+            content=thumb_data,
+            media_type=THUMB_MEDIA_TYPE,
+            headers={
+                "Cache-Control": "max-age=3600",
+                "Content-Disposition": f"inline; filename={image_id}.{THUMB_MEDIA_TYPE.split('/')[1]}",
+                "ETag": image_cache.etag(key) or content_etag(thumb_data)
+            }
+        )
 
     except mysql.connector.Error as err:
         logger.error(f"Database error while fetching thumbnail: {str(err)}")
@@ -923,32 +1643,35 @@ async def get_image(id: str):
     
     logger.info(f"Fetching image metadata: id: {id}")
     try:
-        cursor = conn.cursor(dictionary=True)
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
         
-        # Fetch image metadata from database
-        select_query = "SELECT * FROM images WHERE id = %s"
-        cursor.execute(select_query, (id,))
-        image_metadata = cursor.fetchone()
-        if not image_metadata:
-            raise HTTPException(status_code=404, detail="Image not found")
+            # Fetch image metadata from database
+            select_query = "SELECT * FROM images WHERE id = %s"
+            cursor.execute(select_query, (id,))
+            image_metadata = cursor.fetchone()
+            if not image_metadata:
+                raise HTTPException(status_code=404, detail="Image not found")
         
-        # Fetch image data from S3
-        # Encode image to base64
-        # image_base64 = await getImageDataB64Async(id)
+            # Fetch image data from S3
+            # Encode image to base64
+            # image_base64 = await getImageDataB64Async(id)
         
-        # Prepare response
-        response = {
-            "id": id,
-            "projectId": image_metadata['project_id'],
-            # "data": image_base64,
-            "type": image_metadata['type'],
-            "seed": image_metadata.get('seed'),
-            "prompt": image_metadata.get('prompt'),
-            "parameters": json.loads(image_metadata['parameters']) if image_metadata.get('parameters') else {},
-        }
+            # Prepare response
+            response = {
+                "id": id,
+                "projectId": image_metadata['project_id'],
+                # "data": image_base64,
+                "type": image_metadata['type'],
+                "seed": image_metadata.get('seed'),
+                "prompt": image_metadata.get('prompt'),
+                "parameters": json.loads(image_metadata['parameters']) if image_metadata.get('parameters') else {},
+            }
         
-        cursor.close()
-        return JSONResponse(content=response)
+            cursor.close()
+            return JSONResponse(content=response)
+
+        return await db_pool.run(run_query)
 
     except mysql.connector.Error as err:
         raise HTTPException(status_code=500, detail=f"Database error: {str(err)}")
@@ -956,45 +1679,103 @@ async def get_image(id: str):
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
 @app.get("/img/{imageId}/file")
-async def get_image_file(imageId: str):
+async def get_image_file(imageId: str,
+                         range_header: Optional[str] = Header(None, alias="Range"),
+                         if_none_match: Optional[str] = Header(None),
+                         if_modified_since: Optional[str] = Header(None)):
     try:
-        cursor = conn.cursor(dictionary=True)
+        def run_query(conn):
+            cursor = conn.cursor(dictionary=True)
         
-        # Get image metadata first
-        query = "SELECT type FROM images WHERE id = %s"
-        cursor.execute(query, (imageId,))
-        result = cursor.fetchone()
-        cursor.close()
+            # Get image metadata first
+            query = "SELECT type, blob_key FROM images WHERE id = %s"
+            cursor.execute(query, (imageId,))
+            result = cursor.fetchone()
+            cursor.close()
+            return result
+
+        result = await db_pool.run(run_query)
         
         if not result:
             return JSONResponse(
                 status_code=404,
                 content={"error": "Image not found"}
             )
-            
-        # Get the image data from S3
-        content_type = result['type']
-        s3_key = f"images/{imageId}"
         
+        content_type = result['type']
+        blob_key = result['blob_key']
+
+        if IMAGE_DELIVERY == "redirect":
+            return presigned_redirect(blob_key, content_type)
+
+        headers = {
+            "Cache-Control": "max-age=3600",
+            "Content-Disposition": f"inline; filename={imageId}",
+            "Accept-Ranges": "bytes",
+        }
+
+        # Revalidation with a known ETag never touches S3
+        etag = image_cache.etag(blob_key)
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag, cache_control="max-age=3600")
+
+        # Serve hot images straight from the cache
+        image_data = image_cache.get(blob_key)
+        if image_data is not None:
+            headers["ETag"] = image_cache.etag(blob_key) or content_etag(image_data)
+            return cached_image_response(image_data, content_type, headers,
+                                         range_header)
+
+        # Otherwise stream the object (or the requested range) from S3,
+        # letting S3 evaluate validators we cannot answer locally
+        s3_args = {"Bucket": "scottish-leader", "Key": blob_key}
+        if range_header and parse_range(range_header):
+            s3_args["Range"] = range_header
+        if if_none_match:
+            s3_args["IfNoneMatch"] = if_none_match
+        elif if_modified_since:
+            try:
+                s3_args["IfModifiedSince"] = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                pass
         try:
-            s3_response = s3_client.get_object(Bucket="scottish-leader", Key=s3_key)
-            image_data = s3_response['Body'].read()
-        except Exception as e:
+            s3_response = await asyncio.to_thread(s3_client.get_object,
+                                                  **s3_args)
+        except ClientError as e:
+            error = e.response.get('Error', {})
+            if error.get('Code') in ("304", "NotModified"):
+                return not_modified_response(
+                    if_none_match if if_none_match and "," not in if_none_match else None,
+                    cache_control="max-age=3600")
+            if error.get('Code') == "InvalidRange":
+                size = error.get('ActualObjectSize', '*')
+                return Response(status_code=416,
+                                headers={"Content-Range": f"bytes */{size}"})
             logger.error(f"Failed to fetch image from S3: {str(e)}")
             return JSONResponse(
                 status_code=500,
                 content={"error": f"Failed to fetch image: {str(e)}"}
             )
-        
-        # Return image file directly
-        return Response(
-            content=image_data,
-            media_type=content_type,
-            headers={
-                "Cache-Control": "max-age=3600",
-                "Content-Disposition": f"inline; filename={imageId}"
-            }
-        )
+
+        headers["Content-Length"] = str(s3_response['ContentLength'])
+        headers["ETag"] = s3_response['ETag']
+        if s3_response.get('LastModified'):
+            headers["Last-Modified"] = http_date(s3_response['LastModified'])
+        image_cache.set_etag(blob_key, s3_response['ETag'])
+        if s3_response.get('ContentRange'):
+            headers["Content-Range"] = s3_response['ContentRange']
+            return StreamingResponse(stream_s3_body(s3_response['Body']),
+                                     status_code=206,
+                                     media_type=content_type,
+                                     headers=headers)
+        # Fill the cache while streaming a complete, small object
+        size = s3_response['ContentLength']
+        cache_key = blob_key if size <= min(image_cache.max_item_bytes,
+                                            IMAGE_STREAM_CACHE_MAX_BYTES) else None
+        return StreamingResponse(stream_s3_body(s3_response['Body'], cache_key,
+                                                s3_response['ETag'], size),
+                                 media_type=content_type,
+                                 headers=headers)
 
     except mysql.connector.Error as err:
         logger.error(f"Database error while fetching image: {str(err)}")
@@ -1009,20 +1790,184 @@ async def get_image_file(imageId: str):
             content={"error": f"Server error: {str(e)}"}
         )
         
-async def getImageDataB64Async(id: str):
-    # Fetch image data from S3
-    s3_key = f"images/{id}"
+def parse_range(range_header, size=None):
+    """
+    Parse a single ``bytes=`` range. Multiple ranges are not supported and
+    yield None, which means "send the whole image".
+    Args:
+        size: Total length, needed to resolve open and suffix ranges.
+    Returns:
+        tuple: Inclusive (start, end), or None to ignore the header.
+    Raises:
+        ValueError: If the range cannot be satisfied for ``size``.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    suffix = None
     try:
-        s3_response = s3_client.get_object(Bucket="scottish-leader", Key=s3_key)
+        if not start:
+            suffix = int(end)
+        else:
+            start = int(start)
+            end = int(end) if end else None
+    except ValueError:
+        return None
+    if suffix is not None:
+        if size is None:
+            return (None, suffix)
+        if suffix <= 0:
+            raise ValueError("Empty suffix range")
+        return (max(0, size - suffix), size - 1)
+    if end is not None and end < start:
+        return None
+    if size is None:
+        return (start, end)
+    if start >= size:
+        raise ValueError("Range starts past the end of the image")
+    return (start, min(end if end is not None else size - 1, size - 1))
+
+
+def cached_image_response(image_data, content_type, headers, range_header):
+    size = len(image_data)
+    byte_range = None
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416,
+                            headers={"Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return Response(content=image_data, media_type=content_type,
+                        headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=image_data[start:end + 1], status_code=206,
+                    media_type=content_type, headers=headers)
+
+
+def stream_s3_body(body, cache_key=None, etag=None, size=0):
+    """
+    Yield an S3 body in IMAGE_STREAM_CHUNK_SIZE pieces so memory per
+    download stays flat. When ``cache_key`` is given, and the ``size`` bytes
+    fit in the shared stream_buffers budget, the complete object is also
+    put into the image cache once fully sent.
+    """
+    chunks = [] if cache_key and stream_buffers.try_acquire(size) else None
+    try:
+        for chunk in body.iter_chunks(IMAGE_STREAM_CHUNK_SIZE):
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            image_cache.put(cache_key, b"".join(chunks), etag)
+    finally:
+        body.close()
+        if chunks is not None:
+            stream_buffers.release(size)
+
+
+def presigned_redirect(key, content_type):
+    """
+    Redirect to a presigned S3 URL so the bytes bypass the API server.
+    The redirect may be cached by the browser for as long as the URL is valid.
+    """
+    url, max_age = presigned_urls.url(key, content_type)
+    return RedirectResponse(
+        url,
+        status_code=307,
+        headers={"Cache-Control": f"private, max-age={max_age}"}
+    )
+
+
+def fetch_image_bytes(blob_key: str):
+    """
+    Return the bytes of an image blob, from the image cache when possible
+    and from S3 otherwise. Blobs never change, so cached bytes stay valid
+    until the blob is deleted. Blocking; call it off the event loop.
+    """
+    image_data = image_cache.get(blob_key)
+    if image_data is None:
+        s3_response = s3_client.get_object(Bucket="scottish-leader",
+                                           Key=blob_key)
         image_data = s3_response['Body'].read()
-        
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
-        return image_base64
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch image {s3_key} from S3: {str(e)}")
-        
-# Create MySQL connection
-conn = mysql.connector.connect(
+        image_cache.put(blob_key, image_data, s3_response.get('ETag'))
+    return image_data
+
+
+def fetch_thumbnail_bytes(blob_key: str):
+    """
+    Return the thumbnail of an image blob. Thumbnails are rendered once,
+    stored next to the original in S3 and cached like originals. Blocking.
+    """
+    key = thumb_key(blob_key)
+    thumb_data = image_cache.get(key)
+    if thumb_data is not None:
+        return thumb_data
+    try:
+        s3_response = s3_client.get_object(Bucket="scottish-leader", Key=key)
+        thumb_data = s3_response['Body'].read()
+        etag = s3_response.get('ETag')
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ("NoSuchKey", "404"):
+            raise
+        thumb_data = store_thumbnail(blob_key)
+        etag = content_etag(thumb_data)
+    image_cache.put(key, thumb_data, etag)
+    return thumb_data
+
+
+def ensure_thumbnail(blob_key: str):
+    """
+    Make sure the thumbnail of an image blob exists in S3, checking with a
+    HEAD request so the bytes only pass through the API when it has to be
+    rendered. Blocking.
+    """
+    key = thumb_key(blob_key)
+    try:
+        s3_response = s3_client.head_object(Bucket="scottish-leader", Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ("NoSuchKey", "404"):
+            raise
+        thumb_data = store_thumbnail(blob_key)
+        image_cache.put(key, thumb_data, content_etag(thumb_data))
+        return
+    image_cache.set_etag(key, s3_response['ETag'])
+
+
+def store_thumbnail(blob_key: str):
+    """
+    Render the thumbnail of an image blob and upload it. Blocking.
+    """
+    key = thumb_key(blob_key)
+    logger.info(f"Rendering missing thumbnail {key}")
+    thumb_data = render_thumbnail(fetch_image_bytes(blob_key))
+    s3_client.put_object(
+        Bucket="scottish-leader",
+        Key=key,
+        Body=thumb_data,
+        ContentType=THUMB_MEDIA_TYPE
+    )
+    return thumb_data
+
+
+def forget_blobs(blob_keys):
+    """
+    Drop tombstoned blobs and their thumbnails from the local caches and
+    wake the collector, which deletes them from S3.
+    """
+    if not blob_keys:
+        return
+    for blob_key in blob_keys:
+        for key in (blob_key, thumb_key(blob_key)):
+            image_cache.invalidate(key)
+            presigned_urls.invalidate(key)
+    blob_collector.wake()
+
+
+# Create MySQL connection pool
+db_pool = ConnectionPool(
     host=DATABASE_ENDPOINT,
     user=DATABASE_USERNAME,
     password=DATABASE_PASSWORD,
@@ -1033,4 +1978,12 @@ conn = mysql.connector.connect(
 )
 
 
-s3_client = boto3.client("s3")
\ No newline at end of file
+s3_client = boto3.client("s3")
+
+image_cache = ImageCache()
+# Bytes held by downloads being copied into image_cache
+stream_buffers = ByteBudget(IMAGE_STREAM_BUFFER_BYTES)
+
+presigned_urls = PresignedUrlCache(s3_client, "scottish-leader")
+
+blob_collector = BlobCollector(db_pool, s3_client, "scottish-leader")
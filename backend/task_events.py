@@ -0,0 +1,71 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds between task store checks while a stream waits for a change made
+# by another worker, and between keep-alive comments on an idle stream
+TASK_EVENTS_POLL_INTERVAL = float(os.getenv('TASK_EVENTS_POLL_INTERVAL', '2'))
+TASK_EVENTS_KEEPALIVE = float(os.getenv('TASK_EVENTS_KEEPALIVE', '15'))
+
+
+class TaskEvents:
+    """
+    In-process fan-out of task state changes to streaming clients.
+
+    Subscribers get an asyncio queue that receives the public task dict
+    every time the task is published. Publishing is safe from any thread.
+    Changes made by other server processes are not seen here, so streams
+    also re-read the task store while idle.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._loop = None
+
+    @contextmanager
+    def subscribe(self, task_id):
+        """
+        Receive updates for ``task_id`` for the duration of the ``with``
+        block. Must be used from the event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(task_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                queues = self._subscribers.get(task_id)
+                if queues is not None:
+                    queues.discard(queue)
+                    if not queues:
+                        del self._subscribers[task_id]
+
+    def publish(self, task_id, task):
+        with self._lock:
+            queues = list(self._subscribers.get(task_id, ()))
+        if not queues or task is None:
+            return
+        for queue in queues:
+            self._loop.call_soon_threadsafe(queue.put_nowait, task)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tasks": len(self._subscribers),
+                "subscribers": sum(len(q) for q in self._subscribers.values()),
+            }
+
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Number of generation jobs that may run at the same time, and how many more
+# may wait for a free worker before new submissions are rejected.
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '4'))
+GENERATION_QUEUE_SIZE = int(os.getenv('GENERATION_QUEUE_SIZE', '32'))
+
+
+class QueueFullError(Exception):
+    "Raised when the generation queue cannot accept another job"
+
+    def __init__(self, message):
+        self.message = message
+
+
+class TaskQueue:
+    """
+    Bounded pool of asyncio workers running generation jobs on the server's
+    event loop.
+
+    Jobs are coroutine functions called as ``job(task_id, *args)``. Blocking
+    work inside a job must be moved off the loop by the job itself.
+    """
+
+    def __init__(self, workers=GENERATION_WORKERS,
+                 max_queue=GENERATION_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self._queue = None
+        self._worker_tasks = []
+
+    def start(self):
+        """
+        Create the queue and spawn the workers. Must be called from the
+        running event loop (e.g. a FastAPI startup handler).
+        """
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(index))
+            for index in range(self.workers)
+        ]
+        logger.info("Started %d generation workers (queue size %d)",
+                    self.workers, self.max_queue)
+
+    async def stop(self):
+        """
+        Cancel the workers. Jobs still waiting in the queue are dropped.
+        """
+        for worker in self._worker_tasks:
+            worker.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, task_id, job, *args):
+        """
+        Enqueue a job without waiting.
+        Raises:
+            QueueFullError: If the queue is at capacity.
+        """
+        if self._queue is None:
+            raise RuntimeError("TaskQueue.start() has not been called")
+        try:
+            self._queue.put_nowait((task_id, job, args))
+        except asyncio.QueueFull:
+            raise QueueFullError(
+                f"Generation queue is full ({self.max_queue} jobs waiting)")
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "maxQueue": self.max_queue,
+        }
+
+    async def _worker(self, index):
+        while True:
+            task_id, job, args = await self._queue.get()
+            try:
+                await job(task_id, *args)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Worker %d failed on task %s", index, task_id)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,439 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# "sqlite" shares task state between uvicorn workers on the same host and keeps
+# it across restarts; "memory" keeps it inside the current process only.
+TASK_STORE = os.getenv('TASK_STORE', 'sqlite')
+TASK_STORE_PATH = os.getenv('TASK_STORE_PATH', 'generation_tasks.db')
+# Finished tasks are expired TASK_TTL seconds after their last update, and the
+# oldest finished tasks are evicted once more than TASK_MAX_ENTRIES are kept.
+TASK_TTL = float(os.getenv('TASK_TTL', '3600'))
+TASK_MAX_ENTRIES = int(os.getenv('TASK_MAX_ENTRIES', '5000'))
+# How often (seconds) expiry runs as a side effect of create()
+TASK_PURGE_INTERVAL = float(os.getenv('TASK_PURGE_INTERVAL', '30'))
+# A running task not updated for TASK_LEASE seconds is assumed to belong to a
+# dead process and is queued again; live workers refresh it well before then.
+TASK_LEASE = float(os.getenv('TASK_LEASE', '300'))
+
+FINISHED_STATUSES = ("done", "error")
+
+
+class TaskStore(ABC):
+    """
+    Storage for generation task state.
+
+    A task is a dict with ``id``, ``status`` ("queued", "running", "done" or
+    "error"), ``result``, ``error`` and ``urls``. ``kind`` and ``payload``
+    describe the job so that a queued task can be resumed by any worker.
+
+    Finished tasks older than ``ttl`` seconds, or beyond ``max_entries``, are
+    dropped and only remembered by id so that ``get()`` reports them with
+    status "expired". Queued and running tasks are never dropped.
+    """
+
+    def __init__(self, ttl=TASK_TTL, max_entries=TASK_MAX_ENTRIES,
+                 purge_interval=TASK_PURGE_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge >= self.purge_interval:
+            self._last_purge = now
+            self.purge()
+
+    @abstractmethod
+    def purge(self):
+        """
+        Expire finished tasks past their TTL and evict the oldest finished
+        tasks beyond ``max_entries``.
+        """
+
+    @abstractmethod
+    def stats(self):
+        """
+        Returns:
+            dict: Counts of ``live`` tasks and of tasks ``evicted`` for size
+                or ``expired`` by TTL so far.
+        """
+
+    @abstractmethod
+    def create(self, task_id, kind, payload):
+        """
+        Record a new queued task.
+        Returns:
+            dict: The public task view.
+        """
+
+    @abstractmethod
+    def get(self, task_id):
+        """
+        Returns:
+            dict: The public task view, or None if the task is unknown.
+        """
+
+    @abstractmethod
+    def update(self, task_id, **fields):
+        """
+        Set ``fields`` on a task and refresh its update time.
+        """
+
+    @abstractmethod
+    def claim(self, task_id):
+        """
+        Atomically move a queued task to "running".
+        Returns:
+            bool: True if this caller now owns the task.
+        """
+
+    @abstractmethod
+    def pending(self):
+        """
+        Returns:
+            list: (task_id, kind, payload) for every task still queued.
+        """
+
+    @abstractmethod
+    def requeue_stale(self, lease=TASK_LEASE):
+        """
+        Move "running" tasks not updated for ``lease`` seconds back to
+        "queued".
+        Returns:
+            int: The number of tasks re-queued.
+        """
+
+    @abstractmethod
+    def delete(self, task_id):
+        """
+        Forget a task entirely, leaving no tombstone.
+        """
+
+
+def _expired(task_id):
+    return {"id": task_id, "status": "expired", "result": None,
+            "error": "Task result has expired", "urls": None}
+
+
+def _public(task):
+    return {
+        "id": task["id"],
+        "status": task["status"],
+        "result": None,
+        "error": task.get("error"),
+        "urls": task.get("urls"),
+    }
+
+
+class MemoryTaskStore(TaskStore):
+    """
+    Process-local task store. Only suitable for a single worker.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Kept in last-update order so the oldest tasks are at the front
+        self._tasks = OrderedDict()
+        # Ids of dropped tasks, bounded like the tasks themselves
+        self._tombstones = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted = 0
+        self._expired = 0
+
+    def create(self, task_id, kind, payload):
+        now = time.time()
+        task = {"id": task_id, "kind": kind, "payload": payload,
+                "status": "queued", "error": None, "urls": None,
+                "created_at": now, "updated_at": now}
+        with self._lock:
+            self._tasks[task_id] = task
+        self.maybe_purge()
+        if len(self._tasks) > self.max_entries:
+            self.purge()
+        return _public(task)
+
+    def get(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                if (task["status"] in FINISHED_STATUSES
+                        and time.time() - task["updated_at"] > self.ttl):
+                    self._drop(task_id)
+                    self._expired += 1
+                    return _expired(task_id)
+                return _public(task)
+            if task_id in self._tombstones:
+                return _expired(task_id)
+            return None
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task.update(fields, updated_at=time.time())
+                self._tasks.move_to_end(task_id)
+
+    def purge(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            finished = [task for task in self._tasks.values()
+                        if task["status"] in FINISHED_STATUSES]
+            for task in finished:
+                if task["updated_at"] >= cutoff:
+                    break
+                self._drop(task["id"])
+                self._expired += 1
+            for task in finished:
+                if len(self._tasks) <= self.max_entries:
+                    break
+                if task["id"] in self._tasks:
+                    self._drop(task["id"])
+                    self._evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {"live": len(self._tasks), "evicted": self._evicted,
+                    "expired": self._expired}
+
+    def _drop(self, task_id):
+        self._tasks.pop(task_id, None)
+        self._tombstones[task_id] = None
+        while len(self._tombstones) > self.max_entries:
+            self._tombstones.popitem(last=False)
+
+    def claim(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task["status"] != "queued":
+                return False
+            task["status"] = "running"
+            task["updated_at"] = time.time()
+            self._tasks.move_to_end(task_id)
+            return True
+
+    def pending(self):
+        with self._lock:
+            return [(task["id"], task["kind"], task["payload"])
+                    for task in self._tasks.values()
+                    if task["status"] == "queued"]
+
+    def requeue_stale(self, lease=TASK_LEASE):
+        cutoff = time.time() - lease
+        requeued = 0
+        with self._lock:
+            for task in self._tasks.values():
+                if task["status"] == "running" and task["updated_at"] < cutoff:
+                    task["status"] = "queued"
+                    requeued += 1
+        return requeued
+
+    def delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._tombstones.pop(task_id, None)
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    Task store backed by a SQLite file. Every process opening the same path
+    sees the same tasks, and queued tasks survive a restart.
+    """
+
+    def __init__(self, path=TASK_STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT,
+                urls TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, updated_at)")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            """)
+            self._conn.execute("""
+            INSERT OR IGNORE INTO task_counters (name, value)
+            VALUES ('evicted', 0), ('expired', 0)
+            """)
+
+    def create(self, task_id, kind, payload):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO tasks (id, kind, status, payload, created_at, updated_at)
+                VALUES (?, ?, 'queued', ?, ?, ?)
+                """,
+                (task_id, kind, json.dumps(payload), now, now))
+        self.maybe_purge()
+        return {"id": task_id, "status": "queued", "result": None,
+                "error": None, "urls": None}
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, urls, error, updated_at FROM tasks WHERE id = ?",
+                (task_id,)).fetchone()
+        if row is None:
+            return None
+        # Expired on read as well; purge() only runs when tasks are created
+        if row["status"] == "expired" or (
+                row["status"] in FINISHED_STATUSES
+                and time.time() - row["updated_at"] > self.ttl):
+            return _expired(row["id"])
+        return _public({
+            "id": row["id"],
+            "status": row["status"],
+            "error": row["error"],
+            "urls": json.loads(row["urls"]) if row["urls"] else None,
+        })
+
+    def update(self, task_id, **fields):
+        if "urls" in fields and fields["urls"] is not None:
+            fields["urls"] = json.dumps(fields["urls"])
+        if "payload" in fields and fields["payload"] is not None:
+            fields["payload"] = json.dumps(fields["payload"])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE tasks SET {columns} WHERE id = ?",
+                               (*fields.values(), task_id))
+
+    def claim(self, task_id):
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                UPDATE tasks SET status = 'running', updated_at = ?
+                WHERE id = ? AND status = 'queued'
+                """,
+                (time.time(), task_id))
+            return cursor.rowcount == 1
+
+    def pending(self):
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, kind, payload FROM tasks
+                WHERE status = 'queued'
+                ORDER BY created_at ASC
+                """).fetchall()
+        return [(row["id"], row["kind"], json.loads(row["payload"]))
+                for row in rows]
+
+    def requeue_stale(self, lease=TASK_LEASE):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                UPDATE tasks SET status = 'queued', updated_at = ?
+                WHERE status = 'running' AND updated_at < ?
+                """,
+                (now, now - lease))
+            return cursor.rowcount
+
+    def delete(self, task_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+    def purge(self):
+        # Expired rows are kept as small tombstones (no payload or urls) and
+        # are bounded by max_entries as well.
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._conn.execute(
+                    """
+                    UPDATE tasks
+                    SET status = 'expired', payload = NULL, urls = NULL,
+                        error = NULL, updated_at = ?
+                    WHERE status IN ('done', 'error') AND updated_at < ?
+                    """,
+                    (now, now - self.ttl)).rowcount
+                live = self._conn.execute(
+                    "SELECT COUNT(*) FROM tasks WHERE status != 'expired'"
+                ).fetchone()[0]
+                evicted = 0
+                if live > self.max_entries:
+                    evicted = self._conn.execute(
+                        """
+                        UPDATE tasks
+                        SET status = 'expired', payload = NULL, urls = NULL,
+                            error = NULL, updated_at = ?
+                        WHERE id IN (
+                            SELECT id FROM tasks
+                            WHERE status IN ('done', 'error')
+                            ORDER BY updated_at ASC
+                            LIMIT ?
+                        )
+                        """,
+                        (now, live - self.max_entries)).rowcount
+                self._conn.execute(
+                    """
+                    DELETE FROM tasks WHERE id IN (
+                        SELECT id FROM tasks
+                        WHERE status = 'expired'
+                        ORDER BY updated_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,))
+                self._conn.execute(
+                    "UPDATE task_counters SET value = value + ? WHERE name = 'expired'",
+                    (expired,))
+                self._conn.execute(
+                    "UPDATE task_counters SET value = value + ? WHERE name = 'evicted'",
+                    (evicted,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            live = self._conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status != 'expired'"
+            ).fetchone()[0]
+            counters = dict(self._conn.execute(
+                "SELECT name, value FROM task_counters").fetchall())
+        return {"live": live, "evicted": counters.get("evicted", 0),
+                "expired": counters.get("expired", 0)}
+
+
+def create_task_store(backend=TASK_STORE):
+    """
+    Build the task store selected by the TASK_STORE environment variable.
+    """
+    if backend == "memory":
+        return MemoryTaskStore()
+    if backend == "sqlite":
+        logger.info("Using SQLite task store at %s", TASK_STORE_PATH)
+        return SQLiteTaskStore(TASK_STORE_PATH)
+    raise ValueError(f"Unknown TASK_STORE backend: {backend}")
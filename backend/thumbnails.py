@@ -0,0 +1,53 @@
+import io
+import logging
+import os
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels, output format (WEBP or JPEG) and encoder quality
+THUMB_SIZE = int(os.getenv('THUMB_SIZE', '384'))
+THUMB_FORMAT = os.getenv('THUMB_FORMAT', 'WEBP').upper()
+THUMB_QUALITY = int(os.getenv('THUMB_QUALITY', '80'))
+
+THUMB_MEDIA_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+}
+THUMB_EXTENSIONS = {
+    "WEBP": "webp",
+    "JPEG": "jpg",
+}
+
+if THUMB_FORMAT not in THUMB_MEDIA_TYPES:
+    raise ValueError(f"Unsupported THUMB_FORMAT: {THUMB_FORMAT}")
+
+THUMB_MEDIA_TYPE = THUMB_MEDIA_TYPES[THUMB_FORMAT]
+
+
+def thumb_key(s3_key):
+    """
+    S3 key of the thumbnail stored next to the original, e.g.
+    ``images/<id>.thumb384.webp``. Size and format are part of the key so
+    changing the settings produces fresh renditions.
+    """
+    return f"{s3_key}.thumb{THUMB_SIZE}.{THUMB_EXTENSIONS[THUMB_FORMAT]}"
+
+
+def render_thumbnail(image_bytes):
+    """
+    Downscale an image to fit within THUMB_SIZE x THUMB_SIZE.
+    Returns:
+        bytes: The encoded thumbnail.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("RGB", (THUMB_SIZE, THUMB_SIZE))
+    image.thumbnail((THUMB_SIZE, THUMB_SIZE))
+    if THUMB_FORMAT == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    output = io.BytesIO()
+    image.save(output, format=THUMB_FORMAT, quality=THUMB_QUALITY)
+    return output.getvalue()